@@ -1,6 +1,9 @@
 import os
 from flask import Flask
 from .services.llmServices import init_rag
+from .services.ingestJobs import init_jobs
+from .services.memoryCompaction import init_compaction
+from .services.metrics import init_metrics
 from config import Config
 
 def create_app():
@@ -11,7 +14,10 @@ def create_app():
     
     app.config.from_object(Config)
     
+    init_metrics(app)
     init_rag(app)
+    init_jobs(app)
+    init_compaction(app)
     
     from .routes import main
     app.register_blueprint(main)
@@ -1,20 +1,66 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, url_for, Response, stream_with_context
 from werkzeug.utils import secure_filename
+import json
 import os
 from .services.llmServices import (
-    extract_text, 
     get_conversational_answer, 
-    _store_in_long_term_memory, 
-    doc_collection, 
-    chat_collection
+    answer_batch,
+    stream_conversational_answer,
+    _store_in_long_term_memory,
+    query_embedding_cache_stats,
+    answer_cache_stats,
+    rewrite_stats,
+    readiness,
+    start_warmup,
+    warmup,
+    DEFAULT_USER_ID
 )
+from .services.ocrServices import ocr_cache_stats
+from .services.memoryCompaction import compaction_stats
+from .services import metrics
+from .services.ingestJobs import submit_job, submit_bulk_job, get_job, QueueFullError
+from .services.uploadSpool import spool_upload, source_path, UploadTooLargeError
 
 main = Blueprint('main', __name__)
 
+
+def _user_id(data=None):
+    # Namespace for the caller's documents and chat memory
+    user_id = request.headers.get('X-User-Id') or (data or {}).get('user_id') or DEFAULT_USER_ID
+    return str(user_id)[:128]
+
 @main.route('/')
 def home():
     return "✅ Flask Production Ready!"
 
+@main.route('/ready', methods=['GET'])
+def ready():
+    # Readiness: 503 until the models and vector store are loaded; the first probe starts loading them
+    state = readiness()
+    if not state['ready']:
+        start_warmup()
+    return jsonify(state), 200 if state['ready'] else 503
+
+@main.route('/warmup', methods=['POST'])
+def warmup_models():
+    state = warmup()
+    return jsonify(state), 200 if state['ready'] else 503
+
+
+@main.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'query_embedding_cache': query_embedding_cache_stats(),
+        'answer_cache': answer_cache_stats(),
+        'query_rewrite': rewrite_stats(),
+        'ocr_cache': ocr_cache_stats(),
+        'memory_compaction': compaction_stats()
+    })
+
+@main.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @main.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -26,46 +72,81 @@ def upload_file():
     
     if file:
         filename = secure_filename(file.filename)
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        print(f"File saved to {filepath}")
-        
+        user_id = _user_id(request.form)
+        doc_id = request.form.get('doc_id') or filename
+        # Held in memory when small, in a self-deleting temp file otherwise
+        source = spool_upload(file.stream, current_app.config.get('UPLOAD_SPOOL_MAX_BYTES', 8 << 20),
+                              current_app.config['UPLOAD_FOLDER'])
+        metrics.log(f"Spooled {filename} ({'file' if source_path(source) else 'memory'})")
+
         try:
-            print("Extracting text...")
-            chunks = extract_text(filepath)
-            
-            if not chunks:
-                return jsonify({'message': 'File processed, but no text found.'}), 200
-
-            print(f"Extracted {len(chunks)} chunks. Adding to ChromaDB...")
-            
-            documents_to_add = [chunk['content'] for chunk in chunks]
-            metadatas_to_add = [{'page': chunk['page_number']} for chunk in chunks]
-            ids_to_add = [f"{filename}_chunk_{i}" for i in range(len(chunks))]
-            
-            try:
-                # Clear BOTH collections
-                doc_collection.delete(where={"page": {"$gte": 0}})
-                chat_collection.delete(where={"page": {"$gte": 0}})
-                print("Cleared old document and chat data.")
-            except Exception as e:
-                print(f"Could not clear collections (it might be empty): {e}")
-
-            # Add to the DOCUMENT collection
-            doc_collection.add(
-                documents=documents_to_add,
-                metadatas=metadatas_to_add,
-                ids=ids_to_add
-            )
-            
-            print("Successfully added chunks to doc_collection.")
-            os.remove(filepath)
-            
-            return jsonify({'message': f'File processed and embedded successfully. {len(chunks)} chunks added.'})
+            job_id = submit_job(source, filename, user_id, doc_id)
+        except QueueFullError as e:
+            source.close()
+            return jsonify({'error': str(e)}), 503
+        except Exception:
+            source.close()
+            raise
 
-        except Exception as e:
-            print(f"Error during processing: {e}")
-            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            'message': 'File accepted for processing.',
+            'job_id': job_id,
+            'doc_id': doc_id,
+            'status_url': url_for('main.job_status', job_id=job_id)
+        }), 202
+
+
+@main.route('/upload/bulk', methods=['POST'])
+def upload_bulk():
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files selected'}), 400
+    if len(files) > current_app.config.get('BULK_MAX_FILES', 200):
+        return jsonify({'error': 'Too many files in one upload'}), 413
+
+    user_id = _user_id(request.form)
+    uploads = []
+    # One in-memory allowance and one size limit for the whole request, not per file
+    memory_left = current_app.config.get('UPLOAD_SPOOL_MAX_BYTES', 8 << 20)
+    bytes_left = current_app.config.get('BULK_MAX_BYTES', 512 << 20)
+    try:
+        for file in files:
+            filename = secure_filename(file.filename)
+            source = spool_upload(file.stream, memory_left, current_app.config['UPLOAD_FOLDER'], max_bytes=bytes_left)
+            uploads.append((source, filename))
+            size = source.seek(0, os.SEEK_END)
+            source.seek(0)
+            bytes_left -= size
+            if not source_path(source):
+                memory_left -= size
+        metrics.log(f"Spooled {len(uploads)} files for bulk ingestion")
+        job_id = submit_bulk_job(uploads, user_id)
+    except UploadTooLargeError:
+        for source, _ in uploads:
+            source.close()
+        return jsonify({'error': 'Upload is too large'}), 413
+    except QueueFullError as e:
+        for source, _ in uploads:
+            source.close()
+        return jsonify({'error': str(e)}), 503
+    except Exception:
+        for source, _ in uploads:
+            source.close()
+        raise
+
+    return jsonify({
+        'message': f'{len(uploads)} files accepted for processing.',
+        'job_id': job_id,
+        'status_url': url_for('main.job_status', job_id=job_id)
+    }), 202
+
+
+@main.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id, _user_id(request.args))
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    return jsonify(job)
   
   
 @main.route('/ask', methods=['POST'])
@@ -76,19 +157,118 @@ def askQuery():
     
     query_text = data['query']
     chat_history = data.get('history', [])
+    user_id = _user_id(data)
+    doc_id = data.get('doc_id')
     
-    print(f"Received query: {query_text}")
-    print(f"History length: {len(chat_history)}")
+    metrics.log(f"Received query: {query_text}")
+    metrics.log(f"History length: {len(chat_history)}")
     
     # Call the new conversational function
-    result = get_conversational_answer(query_text, chat_history)
+    result = get_conversational_answer(query_text, chat_history, user_id, doc_id)
     
     # Store this turn in long-term memory
     # (Only store if it wasn't an error)
     if not result['answer'].startswith("Error"):
         try:
-            _store_in_long_term_memory(query_text, result['answer'])
+            _store_in_long_term_memory(query_text, result['answer'], user_id, doc_id)
         except Exception as e:
-            print(f"Error saving to long-term memory: {e}")
+            metrics.log(f"Error saving to long-term memory: {e}")
     
-    return jsonify(result)
\ No newline at end of file
+    return jsonify(result)
+
+
+@main.route('/ask/batch', methods=['POST'])
+def askQueryBatch():
+    """Answers a list of questions (a quiz or flashcard set) in one request.
+
+    ``questions`` holds strings or ``{'query', 'history', 'doc_id'}`` objects;
+    a top-level ``doc_id`` applies to items without their own. Results come
+    back in order, each with ``answer`` and ``sources`` or an ``error``.
+    """
+    data = request.get_json()
+    questions = (data or {}).get('questions')
+    if not isinstance(questions, list) or not questions:
+        return jsonify({'error': 'No questions provided'}), 400
+    max_questions = current_app.config.get('ASK_BATCH_MAX_QUESTIONS', 100)
+    if len(questions) > max_questions:
+        return jsonify({'error': f'At most {max_questions} questions per batch'}), 413
+
+    user_id = _user_id(data)
+    items = []
+    for item in questions:
+        if isinstance(item, str):
+            item = {'query': item}
+        if not isinstance(item, dict) or not isinstance(item.get('query'), str) or not item['query'].strip():
+            return jsonify({'error': 'Each question needs a query'}), 400
+        items.append({
+            'query': item['query'],
+            'history': item.get('history') or [],
+            'doc_id': item.get('doc_id', data.get('doc_id'))
+        })
+
+    metrics.log(f"Received batch of {len(items)} questions")
+    results, timings = answer_batch(items, user_id)
+
+    for item, result in zip(items, results):
+        if 'answer' in result and not result['answer'].startswith("Error"):
+            try:
+                _store_in_long_term_memory(item['query'], result['answer'], user_id, item['doc_id'])
+            except Exception as e:
+                metrics.log(f"Error saving to long-term memory: {e}")
+
+    return jsonify({'results': results, 'timings': timings})
+
+
+@main.route('/ask/stream', methods=['POST'])
+def askQueryStream():
+    """Same as /ask, but answers as Server-Sent Events.
+
+    Emits one ``sources`` event, then ``token`` events while Gemini generates,
+    then ``done`` with the full answer and, unless it came from the answer
+    cache, the ``prompt_tokens`` breakdown (or ``error``).
+    """
+    data = request.get_json()
+    if 'query' not in data:
+        return jsonify({'error': 'No query provided'}), 400
+
+    query_text = data['query']
+    chat_history = data.get('history', [])
+    user_id = _user_id(data)
+    doc_id = data.get('doc_id')
+
+    metrics.log(f"Received streaming query: {query_text}")
+
+    def generate():
+        parts = []
+        done = {}
+        try:
+            for event, payload in stream_conversational_answer(query_text, chat_history, user_id, doc_id):
+                if event == 'prompt_tokens':
+                    done['prompt_tokens'] = payload
+                    continue
+                if event == 'token':
+                    parts.append(payload)
+                yield _sse(event, payload)
+        except Exception as e:
+            metrics.log(f"Error while streaming answer: {e}")
+            yield _sse('error', {'error': str(e)})
+            return
+
+        answer = "".join(parts)
+        yield _sse('done', {'answer': answer, **done})
+
+        # The client already has the full answer; store the turn once the stream is closed
+        try:
+            _store_in_long_term_memory(query_text, answer, user_id, doc_id)
+        except Exception as e:
+            metrics.log(f"Error saving to long-term memory: {e}")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
@@ -0,0 +1,122 @@
+# answerCache.py
+# Semantic cache of final answers: a question whose embedding is close enough
+# to one already answered for the same document version gets the stored
+# answer back without rewrite, retrieval or generation.
+#
+# Cached answers live in each process, but document versions can be kept in
+# a SQLite file shared by every gunicorn worker: a re-ingest in one worker
+# then retires the answers every other worker holds about that document.
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class AnswerCache:
+    def __init__(self, max_entries, ttl_seconds, threshold, versions_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> (scope, unit vector, result, expires_at)
+        self._by_scope = {}            # scope -> set of entry ids
+        self._versions = {}            # (user_id, doc_id or None) -> int, when not shared
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._conn = None
+        if versions_path:
+            os.makedirs(os.path.dirname(versions_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(versions_path, timeout=10, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS versions ("
+                " user_id TEXT NOT NULL, doc_id TEXT NOT NULL, version INTEGER NOT NULL,"
+                " PRIMARY KEY (user_id, doc_id))"
+            )
+            self._conn.commit()
+
+    def scope(self, user_id, doc_id):
+        """Cache scope for a question about ``doc_id`` (or all of the user's documents if None).
+
+        Includes the document version, so an answer computed before a
+        re-ingest can never be served after it.
+        """
+        with self._lock:
+            if self._conn is None:
+                return (user_id, doc_id, self._versions.get((user_id, doc_id), 0))
+            row = self._conn.execute(
+                "SELECT version FROM versions WHERE user_id = ? AND doc_id = ?", (user_id, doc_id or "")
+            ).fetchone()
+            return (user_id, doc_id, row[0] if row else 0)
+
+    def lookup(self, scope, vector):
+        if self.max_entries <= 0:
+            return None
+        query = _unit(vector)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_scope.get(scope, ())):
+                _, unit, _, expires_at = self._entries[entry_id]
+                if expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(query, unit))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def store(self, scope, vector, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (scope, _unit(vector), result, time.time() + self.ttl_seconds)
+            self._by_scope.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id, doc_id):
+        """Drops answers about ``doc_id`` and about "all documents" of ``user_id``."""
+        with self._lock:
+            for key in ((user_id, doc_id), (user_id, None)):
+                self._versions[key] = self._versions.get(key, 0) + 1
+            if self._conn is not None:
+                # Other workers see the new version on their next scope() call
+                self._conn.executemany(
+                    "INSERT INTO versions (user_id, doc_id, version) VALUES (?, ?, 1)"
+                    " ON CONFLICT (user_id, doc_id) DO UPDATE SET version = version + 1",
+                    [(user_id, doc_id or ""), (user_id, "")]
+                )
+                self._conn.commit()
+            for scope in [s for s in self._by_scope if s[0] == user_id and s[1] in (doc_id, None)]:
+                for entry_id in list(self._by_scope[scope]):
+                    self._remove(entry_id)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'max_entries': self.max_entries}
+
+    def _remove(self, entry_id):
+        # Caller holds _lock
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._by_scope[scope]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_scope[scope]
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,255 @@
+# bm25Index.py
+# In-process BM25 inverted index kept next to each Chroma document collection,
+# so exact terms (formula names, course codes, rare words) that dense
+# embeddings blur can still be matched.
+#
+# Every gunicorn worker holds its own copy. A worker picks up what others
+# saved when the file changes (refresh()), and save() merges under a file
+# lock: changes not saved yet are replayed on top of the file's current
+# contents, so one worker's save never drops another's chunks.
+import contextlib
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; saves are then unlocked
+    fcntl = None
+
+_TERM_RE = re.compile(r"\w+")
+_STATE_KEYS = ('k1', 'b', '_postings', '_doc_len', '_chunk_doc', '_chunk_terms', '_total_len')
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its of on or
+so than that the their then there these they this to was were what when where which
+who why will with you your
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TERM_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class Bm25Index:
+    """Postings lists ``term -> {chunk_id: tf}`` plus what is needed to update them incrementally."""
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._doc_len = {}
+        self._chunk_doc = {}     # chunk_id -> doc_id, for per-document filtering
+        self._chunk_terms = {}   # chunk_id -> distinct terms, so a chunk can be removed
+        self._total_len = 0
+        # Search caches, rebuilt on demand after any change and never saved
+        self._impacts = {}       # term -> (chunk positions, per-chunk scores) as numpy arrays
+        self._positions = None   # (chunk ids, chunk_id -> position)
+        self._doc_chunks = None  # doc_id -> chunk ids
+        self._pending = []       # changes since the last save, replayed onto what other workers saved
+        self._stamp = None       # identity of the file as last read or written
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path):
+        """Returns the index persisted at ``path``, or None if there is none yet."""
+        if not os.path.exists(path):
+            return None
+        index = cls(path)
+        index._read()
+        return index
+
+    def refresh(self):
+        """Reloads the index if another process saved it since this one last read or wrote it.
+
+        Changes this process hasn't saved yet are replayed on top. Costs one
+        stat() when nothing changed.
+        """
+        stamp = _file_stamp(self.path)
+        if stamp is None or stamp == self._stamp:
+            return
+        with self._lock:
+            if _file_stamp(self.path) != self._stamp:
+                self._read()
+
+    def save(self):
+        """Writes the index, first merging in whatever other processes saved since this one read it."""
+        with self._lock, _file_lock(f"{self.path}.lock"):
+            if _file_stamp(self.path) not in (None, self._stamp):
+                self._read()
+            state = {key: getattr(self, key) for key in _STATE_KEYS}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._stamp = _file_stamp(self.path)
+            self._pending = []
+
+    def _read(self):
+        # Caller holds _lock (or the index isn't shared yet). os.replace() makes
+        # every save atomic, so this never sees a half-written file.
+        stamp = _file_stamp(self.path)
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        for key in _STATE_KEYS:
+            setattr(self, key, state[key])
+        self._stamp = stamp
+        self._clear_caches()
+        pending, self._pending = self._pending, []
+        for change in pending:
+            self._apply(change)
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, chunk_ids, texts, doc_ids):
+        with self._lock:
+            self._clear_caches()
+            for chunk_id, text, doc_id in zip(chunk_ids, texts, doc_ids):
+                terms = tokenize(text)
+                counts = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                self._apply(('add', chunk_id, counts, len(terms), doc_id))
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            self._clear_caches()
+            for chunk_id in chunk_ids:
+                self._apply(('remove', chunk_id))
+
+    def _apply(self, change):
+        # Caller holds _lock
+        self._pending.append(change)
+        chunk_id = change[1]
+        if chunk_id in self._doc_len:
+            self._remove_one(chunk_id)
+        if change[0] == 'add':
+            _, _, counts, length, doc_id = change
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[chunk_id] = tf
+            self._doc_len[chunk_id] = length
+            self._chunk_doc[chunk_id] = doc_id
+            self._chunk_terms[chunk_id] = tuple(counts)
+            self._total_len += length
+
+    def _clear_caches(self):
+        # Every impact depends on the average chunk length, so any change voids them all
+        self._impacts.clear()
+        self._positions = None
+        self._doc_chunks = None
+
+    def _remove_one(self, chunk_id):
+        for term in self._chunk_terms.pop(chunk_id):
+            postings = self._postings[term]
+            del postings[chunk_id]
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(chunk_id)
+        del self._chunk_doc[chunk_id]
+
+    def search(self, query_text, k=10, doc_id=None):
+        """Returns up to ``k`` ``(chunk_id, score)`` pairs, best first.
+
+        Exact BM25. Each term's postings are cached as numpy arrays of chunk
+        positions and precomputed per-chunk scores (impacts), so a query is
+        one vectorized add per term plus an argpartition for the top k,
+        instead of a Python loop over every posting. The arrays are rebuilt
+        lazily for the terms queried after the index changes.
+        """
+        with self._lock:
+            n = len(self._doc_len)
+            if not n or k <= 0:
+                return []
+            avg_len = self._total_len / n or 1.0
+            terms = [term for term in set(tokenize(query_text)) if term in self._postings]
+            if not terms:
+                return []
+            if doc_id:
+                return self._search_document(terms, k, doc_id, n, avg_len)
+
+            chunk_ids = self._chunk_positions()[0]
+            scores = np.zeros(n)
+            for term in terms:
+                positions, impacts = self._impact_arrays(term, n, avg_len)
+                scores[positions] += impacts
+            k = min(k, int(np.count_nonzero(scores)))
+            if not k:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+        return [(chunk_ids[i], float(scores[i])) for i in top]
+
+    def _search_document(self, terms, k, doc_id, n, avg_len):
+        # One document's chunks are few: score them directly instead of
+        # walking postings that mostly belong to other documents
+        if self._doc_chunks is None:
+            self._doc_chunks = {}
+            for chunk_id, chunk_doc in self._chunk_doc.items():
+                self._doc_chunks.setdefault(chunk_doc, []).append(chunk_id)
+        lists = [(self._postings[term], self._idf(term, n), None) for term in terms]
+        scores = ((chunk_id, self._score(chunk_id, lists, avg_len)) for chunk_id in self._doc_chunks.get(doc_id, ()))
+        return [item for item in heapq.nlargest(k, scores, key=lambda item: item[1]) if item[1] > 0]
+
+    def _idf(self, term, n):
+        df = len(self._postings[term])
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _term_score(self, idf, tf, chunk_id, avg_len):
+        norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[chunk_id] / avg_len)
+        return idf * tf * (self.k1 + 1) / norm
+
+    def _score(self, chunk_id, lists, avg_len):
+        score = 0.0
+        for postings, idf, _ in lists:
+            tf = postings.get(chunk_id)
+            if tf:
+                score += self._term_score(idf, tf, chunk_id, avg_len)
+        return score
+
+    def _chunk_positions(self):
+        # chunk_id <-> row of the score vector; caller holds _lock
+        if self._positions is None:
+            chunk_ids = list(self._doc_len)
+            self._positions = (chunk_ids, {chunk_id: i for i, chunk_id in enumerate(chunk_ids)})
+        return self._positions
+
+    def _impact_arrays(self, term, n, avg_len):
+        # Built once per term after each change to the index; caller holds _lock
+        arrays = self._impacts.get(term)
+        if arrays is None:
+            index = self._chunk_positions()[1]
+            postings = self._postings[term]
+            idf = self._idf(term, n)
+            positions = np.fromiter((index[chunk_id] for chunk_id in postings), dtype=np.int64, count=len(postings))
+            impacts = np.fromiter((self._term_score(idf, tf, chunk_id, avg_len) for chunk_id, tf in postings.items()),
+                                  dtype=np.float64, count=len(postings))
+            arrays = self._impacts[term] = (positions, impacts)
+        return arrays
+
+
+def _file_stamp(path):
+    # A save replaces the file, so a new inode (or mtime) means someone else wrote it
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,140 @@
+# embeddingBackends.py
+# Interchangeable implementations of the ``embedding_model`` object used by
+# llmServices: anything with ``encode(texts, batch_size)`` returning an array
+# of normalized vectors and a ``tokenizer`` with ``tokenize(text)``.
+# "sentence-transformers" is the PyTorch float model; "onnx" runs the
+# int8-quantized export of the same model on ONNX Runtime, which is several
+# times faster on CPU-only nodes; "remote" sends encode calls to the shared
+# embedding server (embeddingServer.py).
+import os
+
+import numpy as np
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_ONNX_FILE = 'onnx/model_qint8_avx512_vnni.onnx'
+_MAX_SEQ_LENGTH = 256   # what SentenceTransformer uses for all-MiniLM-L6-v2
+
+
+def backend_settings(config):
+    """Keyword arguments for load_embedding_backend() from the EMBEDDING_* settings."""
+    return {
+        'name': config.get("EMBEDDING_BACKEND", "sentence-transformers"),
+        'model_name': config.get("EMBEDDING_MODEL", DEFAULT_MODEL),
+        'threads': config.get("EMBEDDING_THREADS", 0),
+        'onnx_file': config.get("EMBEDDING_ONNX_FILE", DEFAULT_ONNX_FILE),
+        'server_address': config.get("EMBEDDING_SERVER_ADDRESS"),
+        'server_authkey': config.get("EMBEDDING_SERVER_AUTHKEY"),
+        'server_timeout': config.get("EMBEDDING_SERVER_TIMEOUT_S", 30.0),
+        'server_max_batch': config.get("EMBEDDING_MAX_BATCH", 64),
+    }
+
+
+def load_embedding_backend(name="sentence-transformers", model_name=DEFAULT_MODEL, threads=0,
+                           onnx_file=DEFAULT_ONNX_FILE, server_address=None, server_authkey=None,
+                           server_timeout=30.0, server_max_batch=64):
+    """Returns an embedding model for backend ``name``; ``threads`` of 0 keeps the library default."""
+    if name == "onnx":
+        return OnnxEmbeddingModel(model_name, threads=threads, onnx_file=onnx_file)
+    if name == "remote":
+        from .embeddingServer import RemoteEmbeddingModel
+        return RemoteEmbeddingModel(server_address, server_authkey, timeout=server_timeout,
+                                    model_name=model_name, max_batch=server_max_batch)
+    if name != "sentence-transformers":
+        raise ValueError(f"Unknown embedding backend: {name}")
+
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name)
+
+
+class _TokenCounter:
+    """Gives a ``tokenizers.Tokenizer`` the ``tokenize`` method the chunker expects."""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def tokenize(self, text):
+        return self._tokenizer.encode(text, add_special_tokens=False).tokens
+
+
+def load_token_counter(model_name=DEFAULT_MODEL):
+    """Just the model's tokenizer, for counting chunk tokens without loading the model.
+
+    Returns None when the tokenizer can't be fetched; callers then fall back
+    to an approximate count.
+    """
+    try:
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+        repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        tokenizer = Tokenizer.from_file(hf_hub_download(repo_id=repo_id, filename="tokenizer.json"))
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        return _TokenCounter(tokenizer)
+    except Exception as e:
+        print(f"Could not load tokenizer for {model_name}, using approximate token counts: {e}")
+        return None
+
+
+class OnnxEmbeddingModel:
+    """Mean-pooled, L2-normalized sentence embeddings from an ONNX export of ``model_name``.
+
+    The model and tokenizer files come from the model's Hugging Face repo and
+    are cached locally by huggingface_hub after the first download.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, threads=0, onnx_file=DEFAULT_ONNX_FILE):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        model_path = hf_hub_download(repo_id=repo_id, filename=onnx_file)
+        tokenizer_path = hf_hub_download(repo_id=repo_id, filename="tokenizer.json")
+
+        self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._tokenizer.enable_truncation(max_length=_MAX_SEQ_LENGTH)
+        self._tokenizer.enable_padding()
+        # Counting must see the whole text, so it gets an untruncated copy
+        counter = Tokenizer.from_file(tokenizer_path)
+        counter.no_truncation()
+        counter.no_padding()
+        self.tokenizer = _TokenCounter(counter)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(model_path, sess_options=options,
+                                             providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        print(f"Loaded ONNX embedding model {repo_id}/{os.path.basename(onnx_file)} "
+              f"({threads or 'default'} threads).")
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        vectors = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        if not vectors:
+            return np.zeros((0, self._session.get_outputs()[0].shape[-1]), dtype=np.float32)
+        result = np.vstack(vectors)
+        return result[0] if single else result
+
+    def _encode_batch(self, texts):
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+
+        token_embeddings = self._session.run(None, feeds)[0]
+        # Mean pooling over real tokens, then normalize, as the SentenceTransformer pipeline does
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
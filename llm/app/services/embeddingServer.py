@@ -0,0 +1,323 @@
+# embeddingServer.py
+# One embedding model per host, shared by every gunicorn worker. The server
+# process holds the model and gathers encode requests arriving from all
+# workers into micro-batches (up to EMBEDDING_MAX_BATCH texts, waiting at
+# most EMBEDDING_MAX_WAIT_MS for company), so concurrent single-query encodes
+# run as one forward pass. Workers use RemoteEmbeddingModel
+# (EMBEDDING_BACKEND=remote) in place of a local model.
+#
+# Started by the gunicorn on_starting hook (gunicorn.conf.py), whose
+# ServerSupervisor restarts it if it dies, or on its own:
+#   EMBEDDING_SERVER_AUTHKEY=... python -m app.services.embeddingServer
+#
+# Connections authenticate with EMBEDDING_SERVER_AUTHKEY, which has no
+# default: gunicorn generates one per start. Requests are JSON, so the
+# server never unpickles what a client sends.
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+# Unix socket in a directory only this user can enter
+DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), f"study_buddy-{os.getuid()}", "embeddings.sock")
+_MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+
+def parse_address(address):
+    """``host:port`` becomes a TCP address; anything else is a Unix socket path."""
+    address = address or DEFAULT_ADDRESS
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and not address.startswith("/"):
+        return host, int(port)
+    return address
+
+
+def _authkey(authkey):
+    if not authkey:
+        raise RuntimeError("EMBEDDING_SERVER_AUTHKEY must be set to use the embedding server")
+    return authkey.encode('utf-8')
+
+
+def _listen(address, authkey):
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        return Listener(parsed, authkey=_authkey(authkey))
+
+    directory = os.path.dirname(os.path.abspath(parsed))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if directory == os.path.dirname(DEFAULT_ADDRESS):
+        # A shared temp dir: refuse one planted by another user
+        if os.stat(directory).st_uid != os.getuid():
+            raise RuntimeError(f"{directory} belongs to another user")
+        os.chmod(directory, 0o700)
+    if os.path.exists(parsed):
+        os.remove(parsed)  # stale socket from a previous run
+    # The socket file is created 0600 rather than chmod-ed after the fact
+    old_umask = os.umask(0o177)
+    try:
+        return Listener(parsed, authkey=_authkey(authkey))
+    finally:
+        os.umask(old_umask)
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingServer:
+    def __init__(self, model, max_batch=64, max_wait_ms=5):
+        self._model = model
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats = {'requests': 0, 'texts': 0, 'batches': 0}
+        self._stats_lock = threading.Lock()
+
+    def serve_forever(self, address, authkey=None):
+        listener = _listen(address, authkey)
+        threading.Thread(target=self._batch_loop, name="embed-batcher", daemon=True).start()
+        print(f"✅ Embedding server listening on {address} "
+              f"(batches of up to {self._max_batch}, {self._max_wait * 1000:.0f} ms wait).")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # A client with the wrong authkey, or one that hung up mid-handshake
+                print(f"❌ Embedding server rejected a connection: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['avg_batch_texts'] = round(stats['texts'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
+
+    def _handle(self, conn):
+        # Each connection belongs to one client thread: strictly request, then reply
+        try:
+            while True:
+                try:
+                    op, payload = json.loads(conn.recv_bytes(_MAX_REQUEST_BYTES))
+                except (EOFError, OSError):
+                    break
+                except (ValueError, TypeError) as e:
+                    conn.send((f"malformed request: {e}", None))
+                    continue
+                if op == 'encode':
+                    if not isinstance(payload, list) or not all(isinstance(text, str) for text in payload):
+                        conn.send(("encode expects a list of strings", None))
+                        continue
+                    request = _Request(payload)
+                    self._queue.put(request)
+                    request.done.wait()
+                    conn.send((request.error, request.vectors))
+                elif op == 'ping':
+                    conn.send((None, 'pong'))
+                elif op == 'stats':
+                    conn.send((None, self.stats()))
+                else:
+                    conn.send((f"unknown operation {op!r}", None))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self._max_wait
+            while size < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = np.asarray(self._model.encode(texts, batch_size=self._max_batch), dtype=np.float32)
+                offset = 0
+                for request in batch:
+                    request.vectors = vectors[offset:offset + len(request.texts)]
+                    offset += len(request.texts)
+            except Exception as e:
+                for request in batch:
+                    request.error = str(e)
+            with self._stats_lock:
+                self._stats['requests'] += len(batch)
+                self._stats['texts'] += len(texts)
+                self._stats['batches'] += 1
+            for request in batch:
+                request.done.set()
+
+
+class RemoteEmbeddingModel:
+    """Client side of the embedding server, shaped like a local embedding model.
+
+    Each thread keeps its own connection. Token counting for chunking uses a
+    local copy of the model's tokenizer, which is small, rather than a round
+    trip per piece of text.
+    """
+
+    def __init__(self, address=None, authkey=None, timeout=30.0, model_name=None, max_batch=64):
+        from .embeddingBackends import load_token_counter, DEFAULT_MODEL
+        self._address = parse_address(address)
+        self._authkey = _authkey(authkey)
+        self._timeout = timeout
+        self._max_batch = max(1, max_batch)
+        self._local = threading.local()
+        self.tokenizer = load_token_counter(model_name or DEFAULT_MODEL)
+        # The server may still be loading its model when workers start; wait
+        # for it here, and fail (leaving the worker unready) if it never comes up
+        self._local.conn = self._connect(wait=self._timeout)
+        self._call('ping', None)
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        # An ingest batch goes as EMBEDDING_MAX_BATCH-sized requests, so the
+        # server can fit other workers' query encodes in between them
+        size = self._max_batch
+        parts = [self._call('encode', texts[start:start + size]) for start in range(0, len(texts), size)]
+        vectors = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+    def stats(self):
+        return self._call('stats', None)
+
+    def ping(self, timeout=2.0):
+        """Raises unless the server answers within ``timeout`` seconds; used by the readiness probe."""
+        self._call('ping', None, timeout)
+
+    def _connect(self, wait=0.0):
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                return Client(self._address, authkey=self._authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"Embedding server at {self._address} is not reachable")
+                time.sleep(0.2)
+
+    def _call(self, op, payload, timeout=None):
+        timeout = self._timeout if timeout is None else timeout
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                # Once up, a server that refuses connections has died: fail at
+                # once instead of stalling the request while it is restarted
+                conn = self._local.conn = self._connect()
+            try:
+                conn.send_bytes(json.dumps([op, payload]).encode('utf-8'))
+                if not conn.poll(timeout):
+                    raise TimeoutError(f"Embedding server did not answer within {timeout}s")
+                error, result = conn.recv()
+                break
+            except (EOFError, OSError, TimeoutError):
+                # Drop the broken connection; retry once on a fresh one
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        if error:
+            raise RuntimeError(f"Embedding server error: {error}")
+        return result
+
+
+def run_server(config):
+    """Loads the model named by the EMBEDDING_* settings and serves it until the process exits."""
+    from .embeddingBackends import load_embedding_backend, backend_settings
+    settings = backend_settings(config)
+    settings['name'] = config.get("EMBEDDING_SERVER_BACKEND", "sentence-transformers")
+    address = settings.pop('server_address') or DEFAULT_ADDRESS
+    authkey = settings.pop('server_authkey')
+    _authkey(authkey)  # fail before loading the model
+    settings.pop('server_timeout')
+    settings.pop('server_max_batch')
+
+    print(f"Embedding server loading {settings['model_name']} ({settings['name']})...")
+    model = load_embedding_backend(**settings)
+    server = EmbeddingServer(
+        model,
+        max_batch=config.get("EMBEDDING_MAX_BATCH", 64),
+        max_wait_ms=config.get("EMBEDDING_MAX_WAIT_MS", 5)
+    )
+    server.serve_forever(address, authkey)
+
+
+def start_server_process(config):
+    """Starts run_server() in a child process; used by the gunicorn on_starting hook.
+
+    Uses the spawn start method so the child doesn't inherit the master's
+    threads or sockets. Returns the Process.
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_server, args=(dict(config),), name="embedding-server", daemon=True
+    )
+    process.start()
+    return process
+
+
+class ServerSupervisor:
+    """Keeps an embedding server process running, starting a new one whenever it exits.
+
+    Used from the gunicorn master. A server that keeps dying soon after
+    starting is restarted with a delay that doubles up to 30 s.
+    """
+
+    def __init__(self, config, log=print):
+        self._config = dict(config)
+        self._log = log
+        self._stopping = threading.Event()
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        self.process = start_server_process(self._config)
+        threading.Thread(target=self._watch, name="embedding-server-supervisor", daemon=True).start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        process = self.process
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join(timeout)
+
+    def _watch(self):
+        delay = 1.0
+        while True:
+            started = time.monotonic()
+            self.process.join()
+            if self._stopping.is_set():
+                return
+            if time.monotonic() - started > 60:
+                delay = 1.0
+            self._log(f"Embedding server (pid {self.process.pid}) exited with code {self.process.exitcode}; "
+                      f"restarting in {delay:.0f}s")
+            if self._stopping.wait(delay):
+                return
+            self.process = start_server_process(self._config)
+            self.restarts += 1
+            delay = min(delay * 2, 30.0)
+
+
+if __name__ == "__main__":
+    from config import Config
+    run_server({key: getattr(Config, key) for key in dir(Config) if key.isupper()})
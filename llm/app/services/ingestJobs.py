@@ -0,0 +1,282 @@
+# ingestJobs.py
+# Background ingestion: /upload hands the file to a bounded worker pool and
+# returns a job id; /jobs/<id> reports progress until the job finishes.
+# /upload/bulk queues one job for several files or ZIP archives.
+#
+# A job runs in the worker that accepted the upload, but its status lives in
+# a SQLite file (INGEST_JOB_DB) shared by every gunicorn worker, so a poll
+# that lands on another worker still finds it.
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .llmServices import ingest_document, ingest_documents, SUPPORTED_EXTENSIONS
+from .uploadSpool import expand_archive
+from . import metrics
+
+_executor = None
+_db = None
+_jobs = {}  # job id -> job, for the unfinished jobs this process runs
+_lock = threading.Lock()
+_max_pending = 16
+_history = 200
+_bulk_max_files = 200
+_bulk_max_bytes = 512 * 1024 * 1024
+_spool_max_bytes = 8 * 1024 * 1024
+_spool_dir = None
+_bulk_extract_workers = 4
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the ingestion queue already holds INGEST_MAX_PENDING jobs."""
+
+
+def init_jobs(app):
+    """Called from create_app() to size the worker pool from the app config."""
+    global _executor, _db, _max_pending, _history
+    global _bulk_max_files, _bulk_max_bytes, _spool_max_bytes, _spool_dir, _bulk_extract_workers
+
+    workers = app.config.get("INGEST_WORKERS", 2)
+    _max_pending = app.config.get("INGEST_MAX_PENDING", 16)
+    _history = app.config.get("INGEST_JOB_HISTORY", 200)
+    _bulk_max_files = app.config.get("BULK_MAX_FILES", 200)
+    _bulk_max_bytes = app.config.get("BULK_MAX_BYTES", 512 * 1024 * 1024)
+    _spool_max_bytes = app.config.get("UPLOAD_SPOOL_MAX_BYTES", 8 * 1024 * 1024)
+    _spool_dir = app.config.get("UPLOAD_FOLDER")
+    _bulk_extract_workers = app.config.get("BULK_EXTRACT_WORKERS", 4)
+    _db = _open_db(app.config.get("INGEST_JOB_DB", "./ingest_jobs.sqlite3"))
+    _fail_orphaned_jobs()
+    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+    print(f"Ingestion pool started with {workers} workers.")
+
+
+def submit_job(source, filename, user_id, doc_id):
+    """Queues ``source`` for ingestion as ``user_id``/``doc_id`` and returns the new job id.
+
+    ``source`` is an open binary file (from spool_upload) or a path. Once this
+    returns, the worker owns it and closes or deletes it when it is done; if
+    this raises, it is still the caller's.
+    """
+    job_id = _new_job(user_id, filename=filename, doc_id=doc_id)
+    # The job logs under the trace id of the upload that queued it
+    _executor.submit(metrics.bind(_run_job), job_id, source, filename, user_id, doc_id)
+    return job_id
+
+
+def submit_bulk_job(uploads, user_id):
+    """Queues several uploads as one job and returns its id.
+
+    ``uploads`` is a list of ``(source, filename)``; a ``.zip`` filename is
+    expanded on the worker and each supported member becomes its own
+    document. Every other file becomes document ``filename``. BULK_MAX_BYTES
+    covers the whole job: the plain files plus every archive's expanded
+    size. Ownership of the sources passes as in submit_job().
+    """
+    job_id = _new_job(user_id, kind='bulk', files=[], skipped=[])
+    _executor.submit(metrics.bind(_run_bulk_job), job_id, uploads, user_id)
+    return job_id
+
+
+def _new_job(user_id, **fields):
+    with _lock:
+        # INGEST_MAX_PENDING bounds this process's own queue
+        if len(_jobs) >= _max_pending:
+            raise QueueFullError("Ingestion queue is full, try again shortly.")
+
+        job_id = uuid.uuid4().hex
+        job = _jobs[job_id] = {
+            'id': job_id,
+            'kind': 'single',
+            'trace_id': metrics.current_trace_id(),
+            'filename': None,
+            'user_id': user_id,
+            'doc_id': None,
+            'status': 'queued',
+            'stage': 'queued',
+            'pages_total': 0,
+            'pages_extracted': 0,
+            'chunks_total': 0,
+            'chunks_embedded': 0,
+            'chunks_reused': 0,
+            'stats': None,
+            'message': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        job.update(fields)
+        _save(job)
+        _prune()
+    return job_id
+
+
+def get_job(job_id, user_id):
+    """Returns a snapshot of ``user_id``'s job, or None if it is unknown (or long expired).
+
+    Jobs run by any worker are visible.
+    """
+    with _lock:
+        row = _db.execute("SELECT data FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _update(job_id, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+            _save(job)
+
+
+def _finish(job_id):
+    with _lock:
+        job = _jobs.pop(job_id, None)
+        if job is not None:
+            job['finished_at'] = time.time()
+            _save(job)
+
+
+def _open_db(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    # WAL lets other workers read job status while this one writes progress
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id TEXT PRIMARY KEY, user_id TEXT NOT NULL, status TEXT NOT NULL,"
+        " pid INTEGER NOT NULL, created_at REAL NOT NULL, data TEXT NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+
+def _save(job):
+    # Caller holds _lock
+    _db.execute(
+        "INSERT OR REPLACE INTO jobs (id, user_id, status, pid, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+        (job['id'], job['user_id'], job['status'], os.getpid(), job['created_at'], json.dumps(job))
+    )
+    _db.commit()
+
+
+def _fail_orphaned_jobs():
+    # Jobs left queued or running by a worker that has since exited will never
+    # finish; report them as failed instead of running forever
+    with _lock:
+        rows = _db.execute("SELECT pid, data FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        for pid, data in rows:
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            job = json.loads(data)
+            job.update(status='failed', stage='failed', error="The worker running this job exited.",
+                       finished_at=time.time())
+            _save(job)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _run_job(job_id, source, filename, user_id, doc_id):
+    _update(job_id, status='running', stage='processing', started_at=time.time())
+    try:
+        stats = ingest_document(source, filename, user_id, doc_id, report=lambda **f: _update(job_id, **f))
+        if stats['chunks_total']:
+            message = (f"File processed and embedded successfully. {stats['chunks_added']} chunks added, "
+                       f"{stats['chunks_reused']} reused, {stats['chunks_deleted']} removed.")
+        else:
+            message = 'File processed, but no text found.'
+        _update(job_id, status='done', stage='done', message=message, stats=stats)
+    except Exception as e:
+        metrics.log(f"Error during processing of {filename}: {e}")
+        _update(job_id, status='failed', stage='failed', error=str(e))
+    finally:
+        _finish(job_id)
+        _release(source)
+
+
+def _run_bulk_job(job_id, uploads, user_id):
+    _update(job_id, status='running', stage='expanding', started_at=time.time())
+    archives = [(source, filename) for source, filename in uploads if filename.lower().endswith('.zip')]
+    documents = [(source, filename) for source, filename in uploads if not filename.lower().endswith('.zip')]
+    skipped = []
+    # Members are spooled one at a time as extraction reaches them; the
+    # in-memory allowance is split between the files extracted at once
+    member_memory = _spool_max_bytes // max(1, _bulk_extract_workers)
+    try:
+        remaining = _bulk_max_bytes - sum(_size(source) for source, _ in documents)
+        if len(documents) > _bulk_max_files:
+            raise ValueError(f"More than {_bulk_max_files} files in one upload")
+        if remaining < 0:
+            raise ValueError(f"Upload is larger than {_bulk_max_bytes} bytes")
+
+        for source, filename in archives:
+            members, rejected = expand_archive(source, SUPPORTED_EXTENSIONS, _bulk_max_files - len(documents), remaining)
+            remaining -= sum(member.size for member in members)
+            documents.extend((functools.partial(member.open, member_memory, _spool_dir), member.filename)
+                             for member in members)
+            skipped.extend({'archive': filename, **entry} for entry in rejected)
+
+        items = [(source, filename, filename) for source, filename in documents]
+        _update(job_id, stage='processing', skipped=skipped,
+                files=[{'filename': filename, 'doc_id': doc_id, 'status': 'queued'} for _, filename, doc_id in items])
+        results, timings = ingest_documents(items, user_id, report=lambda **f: _update(job_id, **f))
+
+        counts = {status: sum(1 for r in results if r['status'] == status) for status in ('done', 'empty', 'failed')}
+        message = (f"{counts['done']} of {len(results)} files processed and embedded, "
+                   f"{counts['empty']} without text, {counts['failed']} failed.")
+        stats = {key: sum(r.get(key, 0) for r in results)
+                 for key in ('chunks_total', 'chunks_added', 'chunks_reused', 'chunks_deleted')}
+        stats['timings'] = timings
+        _update(job_id, status='done', stage='done', message=message, files=results, stats=stats)
+    except Exception as e:
+        metrics.log(f"Error during bulk processing: {e}")
+        _update(job_id, status='failed', stage='failed', error=str(e))
+    finally:
+        _finish(job_id)
+        for source, _ in uploads:
+            _release(source)
+
+
+def _size(source):
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    size = source.seek(0, os.SEEK_END)
+    source.seek(0)
+    return size
+
+
+def _release(source):
+    # Closing a spooled upload frees its memory or deletes its temp file
+    try:
+        if isinstance(source, str):
+            os.remove(source)
+        else:
+            source.close()
+    except OSError:
+        pass
+
+
+def _prune():
+    # Forget the oldest finished jobs once we keep more than INGEST_JOB_HISTORY.
+    # Caller holds _lock.
+    excess = _db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - _history
+    if excess <= 0:
+        return
+    _db.execute(
+        "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed')"
+        " ORDER BY created_at LIMIT ?)", (excess,)
+    )
+    _db.commit()
@@ -1,106 +1,819 @@
 # rag_core.py
+import atexit
+import contextlib
+import hashlib
+import io
+import queue
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
 import re
-import fitz  # PyMuPDF
-import google.generativeai as genai
-import chromadb
-from sentence_transformers import SentenceTransformer
-import pytesseract
-from PIL import Image
-import io
-import docx
 from flask import current_app
+from .ocrServices import configure_ocr, ocr_pdf_pages
+from .textChunker import chunk_stream, approx_token_count
+from .lruCache import LruCache, normalize_query
+from .answerCache import AnswerCache
+from .bm25Index import Bm25Index
+from . import rerankServices
+from . import metrics
+from .promptPacker import pack_prompt
+from .memoryWriter import WriteBehindBuffer
+from .uploadSpool import source_path
+from .embeddingBackends import load_embedding_backend, backend_settings
 
-doc_collection = None
-chat_collection = None
+# Heavy components are created on first use (or by warmup()); tests may assign stubs directly
+chroma_client = None
 embedding_model = None
 model = None
+_chroma_lock = threading.Lock()
+_embedding_lock = threading.Lock()
+_model_lock = threading.Lock()
+_load_errors = {}           # component -> last load error, for the readiness probe
+_api_key = None
+_embedding_settings = {}    # load_embedding_backend() arguments from the EMBEDDING_* settings
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+DEFAULT_USER_ID = 'default'
+CHROMA_PATH = "./chroma_db"
+
+# Per-user state is bounded by USER_CACHE_SIZE; an evicted BM25 index is
+# loaded again from its pickle the next time that user is seen
+_collections = LruCache(32)    # user_id -> (doc_collection, chat_collection)
+_collections_lock = threading.Lock()
+_ingest_locks = {}             # (user_id, doc_id) -> [Lock, holders]; one ingestion per document at a time
+_bm25_indexes = LruCache(32)   # user_id -> Bm25Index over that user's doc collection
+_CHROMA_METHODS = ('add', 'get', 'query', 'update', 'upsert', 'delete', 'count')
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt')  # what extract_text() can read
+_TEXT_BLOCK_CHARS = 64 * 1024
+_MAX_PARAGRAPH_CHARS = 256 * 1024
+
+_ingest_batch_size = 256
+_bulk_batch_size = 1024
+_bulk_extract_workers = 4
+_embed_batch_size = 32
+_chunk_max_tokens = 200
+_chunk_overlap_tokens = 40
+
+_top_k = 3
+_hybrid_search = True
+_retrieval_candidates = 10
+_rrf_k = 60
+
+_prompt_token_budget = 3000
+_prompt_recent_turns = 6
+
+_query_cache = LruCache(2048)
+_rewrite_memo = LruCache(1024)     # (history digest, normalized query) -> rewritten query
+_rewrite_stats = {'requests': 0, 'skipped': 0, 'memo_hits': 0, 'llm_calls': 0}
+_rewrite_stats_lock = threading.Lock()
+_answer_cache = AnswerCache(1024, 3600, 0.95)
+
+# Pronouns and openers that point back at earlier turns
+_ANAPHORA_RE = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|theirs|he|she|him|her|his|"
+    r"former|latter|above|previous|aforementioned|same)\b", re.IGNORECASE)
+_FOLLOWUP_RE = re.compile(
+    r"^\W*(and|but|so|or|also|what about|how about|then)\b"
+    r"|^\W*(why|how|really|examples?|elaborate|continue|explain|more|go on)\W*$", re.IGNORECASE)
+
+_memory_buffer = None       # write-behind queue for long-term memory turns
+
+_stage_pool = None          # runs rewrite / retrieval stages of one /ask concurrently
+_batch_pool = None          # generation calls of /ask/batch; bounds Gemini concurrency
+_rewrite_timeout = 4.0
+_retrieval_timeout = 3.0
 
 
 def init_rag(app):
     """Called from create_app() AFTER Flask initializes the application context."""
-    global doc_collection, chat_collection, embedding_model, model
+    global _api_key, _embedding_settings
+    global _chunk_max_tokens, _chunk_overlap_tokens, _ingest_batch_size, _embed_batch_size
+    global _bulk_batch_size, _bulk_extract_workers
+    global _stage_pool, _batch_pool, _rewrite_timeout, _retrieval_timeout, _query_cache, _answer_cache, _rewrite_memo
+    global _top_k, _hybrid_search, _retrieval_candidates, _rrf_k, _prompt_token_budget, _prompt_recent_turns
+    global _memory_buffer, _collections, _bm25_indexes
 
     with app.app_context():
         try:
-            API_KEY = current_app.config.get("GOOGLE_API_KEY")
-            if not API_KEY:
-                raise RuntimeError("GOOGLE_API_KEY missing in .env")
-            genai.configure(api_key=API_KEY)
+            # A missing key is reported by get_generative_model() (and /ready);
+            # ingestion and retrieval still work without it
+            _api_key = current_app.config.get("GOOGLE_API_KEY")
+            configure_ocr(current_app.config)
+            rerankServices.configure_reranker(current_app.config)
+            _chunk_max_tokens = current_app.config.get("CHUNK_MAX_TOKENS", 200)
+            _chunk_overlap_tokens = current_app.config.get("CHUNK_OVERLAP_TOKENS", 40)
+            _ingest_batch_size = current_app.config.get("INGEST_BATCH_SIZE", 256)
+            _bulk_batch_size = current_app.config.get("BULK_INGEST_BATCH_SIZE", 1024)
+            _bulk_extract_workers = current_app.config.get("BULK_EXTRACT_WORKERS", 4)
+            _embed_batch_size = current_app.config.get("EMBED_BATCH_SIZE", 32)
+            _embedding_settings = backend_settings(current_app.config)
+            _top_k = current_app.config.get("RETRIEVAL_TOP_K", 3)
+            _hybrid_search = current_app.config.get("HYBRID_SEARCH", True)
+            _retrieval_candidates = current_app.config.get("RETRIEVAL_CANDIDATES", 10)
+            _rrf_k = current_app.config.get("RRF_K", 60)
+            _collections = LruCache(current_app.config.get("USER_CACHE_SIZE", 32))
+            _bm25_indexes = LruCache(current_app.config.get("USER_CACHE_SIZE", 32))
+            _prompt_token_budget = current_app.config.get("PROMPT_TOKEN_BUDGET", 3000)
+            _prompt_recent_turns = current_app.config.get("PROMPT_RECENT_TURNS", 6)
+            _rewrite_timeout = current_app.config.get("REWRITE_TIMEOUT_S", 4.0)
+            _retrieval_timeout = current_app.config.get("RETRIEVAL_TIMEOUT_S", 3.0)
+            _query_cache = LruCache(current_app.config.get("QUERY_EMBED_CACHE_SIZE", 2048))
+            _rewrite_memo = LruCache(current_app.config.get("REWRITE_MEMO_SIZE", 1024))
+            _answer_cache = AnswerCache(
+                current_app.config.get("ANSWER_CACHE_SIZE", 1024),
+                current_app.config.get("ANSWER_CACHE_TTL_S", 3600),
+                current_app.config.get("ANSWER_CACHE_THRESHOLD", 0.95),
+                # Shared by the workers, so a re-ingest anywhere retires every worker's answers
+                versions_path=os.path.join(CHROMA_PATH, "answer_versions.sqlite3")
+            )
+            _stage_pool = ThreadPoolExecutor(
+                max_workers=current_app.config.get("STAGE_WORKERS", 16),
+                thread_name_prefix="rag-stage"
+            )
+            _batch_pool = ThreadPoolExecutor(
+                max_workers=current_app.config.get("ASK_BATCH_CONCURRENCY", 8),
+                thread_name_prefix="ask-batch"
+            )
+            _memory_buffer = WriteBehindBuffer(
+                _write_memory_batch,
+                batch_size=current_app.config.get("MEMORY_WRITE_BATCH", 32),
+                flush_interval=current_app.config.get("MEMORY_FLUSH_INTERVAL_S", 1.0)
+            )
+            # Flush queued turns when the worker shuts down
+            atexit.register(_memory_buffer.close)
 
-            print("Loading embedding model...")
-            embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Models and the Chroma client load lazily so the worker starts serving at once
+            if current_app.config.get("WARMUP_ON_START", False):
+                start_warmup()
 
-            print("Loading generative model...")
-            model = genai.GenerativeModel('gemini-2.0-flash-lite')
+            print("✅ RAG system configured (models load on first use).")
+
+        except Exception as e:
+            print(f"❌ Error during RAG initialization: {e}")
 
-            print("Initializing ChromaDB client...")
-            chroma_client = chromadb.PersistentClient(path="./chroma_db")
 
-            doc_collection = chroma_client.get_or_create_collection(name="study_buddy_doc_store")
-            chat_collection = chroma_client.get_or_create_collection(name="study_buddy_chat_history")
+def get_embedding_model():
+    global embedding_model
+    if embedding_model is None:
+        with _embedding_lock:
+            if embedding_model is None:
+                try:
+                    print(f"Loading embedding model ({_embedding_settings.get('name', 'sentence-transformers')})...")
+                    embedding_model = load_embedding_backend(**_embedding_settings)
+                    _load_errors.pop('embedding_model', None)
+                except Exception as e:
+                    _load_errors['embedding_model'] = str(e)
+                    raise
+    return embedding_model
 
-            print("✅ RAG system initialized successfully.")
 
+def get_generative_model():
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                try:
+                    if not _api_key:
+                        raise RuntimeError("GOOGLE_API_KEY missing in .env")
+                    import google.generativeai as genai
+                    print("Loading generative model...")
+                    genai.configure(api_key=_api_key)
+                    model = genai.GenerativeModel('gemini-2.0-flash-lite')
+                    _load_errors.pop('generative_model', None)
+                except Exception as e:
+                    _load_errors['generative_model'] = str(e)
+                    raise
+    return model
+
+
+def get_chroma_client():
+    global chroma_client
+    if chroma_client is None:
+        with _chroma_lock:
+            if chroma_client is None:
+                try:
+                    import chromadb
+                    print("Initializing ChromaDB client...")
+                    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+                    _load_errors.pop('chroma', None)
+                except Exception as e:
+                    _load_errors['chroma'] = str(e)
+                    raise
+    return chroma_client
+
+
+def warmup():
+    """Loads every heavy component now instead of on the first request. Returns readiness()."""
+    for load in (get_embedding_model, get_generative_model, get_chroma_client):
+        try:
+            load()
         except Exception as e:
-            print(f"❌ Error during RAG initialization: {e}")
+            print(f"❌ Warmup: {e}")
+    try:
+        get_collections(DEFAULT_USER_ID)
+        # One tiny encode so the first real query doesn't pay for lazy kernel setup
+        embed_texts(["warmup"])
+    except Exception as e:
+        print(f"❌ Warmup: {e}")
+    return readiness()
+
+
+def start_warmup():
+    """Runs warmup() on a background thread, once. Returns immediately."""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None or (not _warmup_thread.is_alive() and _load_errors):
+            _warmup_thread = threading.Thread(target=warmup, name="rag-warmup", daemon=True)
+            _warmup_thread.start()
+
+
+def readiness():
+    """``{'ready', 'components', 'errors'}``: ready once every component is loaded.
+
+    A remote embedding model also has to answer a ping, since its server can
+    die after the client was created.
+    """
+    components = {
+        'embedding_model': embedding_model is not None,
+        'generative_model': model is not None,
+        'chroma': chroma_client is not None,
+    }
+    errors = dict(_load_errors)
+    if components['embedding_model'] and hasattr(embedding_model, 'ping'):
+        try:
+            embedding_model.ping()
+        except Exception as e:
+            components['embedding_model'] = False
+            errors['embedding_model'] = str(e)
+    return {'ready': all(components.values()), 'components': components, 'errors': errors}
+
+
+def get_collections(user_id):
+    """Returns ``(doc_collection, chat_collection)`` for ``user_id``.
+
+    Every user gets their own pair of collections, so a query only ever
+    searches that user's data. Documents within a user's collections are told
+    apart by the ``doc_id`` metadata field. The default user keeps the
+    original collection names so existing data stays reachable.
+    """
+    with _collections_lock:
+        collections = _collections.get(user_id)
+        if collections is None:
+            if user_id == DEFAULT_USER_ID:
+                doc_name, chat_name = "study_buddy_doc_store", "study_buddy_chat_history"
+            else:
+                key = hashlib.sha1(user_id.encode('utf-8')).hexdigest()[:24]
+                doc_name, chat_name = f"docs_{key}", f"chat_{key}"
+            # Every Chroma call made through these is timed as a 'chroma' span
+            collections = (
+                metrics.timed_proxy(get_chroma_client().get_or_create_collection(name=doc_name),
+                                    'chroma', _CHROMA_METHODS),
+                metrics.timed_proxy(get_chroma_client().get_or_create_collection(name=chat_name),
+                                    'chroma', _CHROMA_METHODS)
+            )
+            _collections.put(user_id, collections)
+        return collections
+
+
+def get_bm25_index(user_id):
+    """Returns the BM25 index over ``user_id``'s documents, loading it from disk on first use.
+
+    The index is persisted under CHROMA_PATH/bm25/ next to the collection,
+    and reloaded when another worker has saved it since. If there is no
+    saved index yet (data ingested before hybrid search existed), it is
+    rebuilt once from the documents stored in Chroma.
+    """
+    with _collections_lock:
+        index = _bm25_indexes.get(user_id)
+    if index is not None:
+        index.refresh()
+        return index
+
+    doc_collection, _ = get_collections(user_id)
+    path = os.path.join(CHROMA_PATH, "bm25", f"{doc_collection.name}.pkl")
+    index = Bm25Index.load(path)
+    if index is None:
+        index = Bm25Index(path)
+        offset = 0
+        while True:
+            page = doc_collection.get(include=['documents', 'metadatas'], limit=1000, offset=offset)
+            if not page['ids']:
+                break
+            index.add(page['ids'], page['documents'], [(meta or {}).get('doc_id') for meta in page['metadatas']])
+            offset += len(page['ids'])
+        index.save()
+        metrics.log(f"Built BM25 index for {doc_collection.name} ({len(index)} chunks).")
+
+    with _collections_lock:
+        cached = _bm25_indexes.get(user_id)
+        if cached is not None:
+            return cached
+        _bm25_indexes.put(user_id, index)
+    return index
+
+
+def _doc_filter(doc_id):
+    return {"doc_id": doc_id} if doc_id else None
 
 
-def extract_text(file_path):
-    chunks = []
-    if file_path.endswith('.txt'):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        for paragraph in text.split('\n\n'):
+def extract_text(source, filename, on_page=None):
+    """Yields the document's chunks as its pages are parsed.
+
+    ``source`` is a path or a binary file object (see uploadSpool); the
+    format comes from ``filename``. Nothing reads the whole file at once:
+    TXT is decoded incrementally, PDFs are opened from their path when they
+    have one, and pages flow through one at a time.
+
+    Chunks hold at most CHUNK_MAX_TOKENS embedding-model tokens and keep the
+    page range they came from. ``on_page(done, total)`` is called after each page.
+    """
+    return chunk_stream(
+        _iter_segments(source, filename, on_page),
+        max_tokens=_chunk_max_tokens,
+        overlap_tokens=_chunk_overlap_tokens,
+        count_tokens=_count_tokens
+    )
+
+
+def _iter_segments(source, filename, on_page):
+    # Yields (page_number, text) in reading order
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.txt':
+        for paragraph in metrics.timed_iter(_iter_paragraphs(source), 'extract_page', 'txt'):
             if paragraph.strip():
-                chunks.append({'page_number': 1, 'content': paragraph})
+                yield 1, paragraph
+        if on_page:
+            on_page(1, 1)
 
-    elif file_path.endswith('.pdf'):
+    elif extension == '.pdf':
+        doc = None
         try:
-            doc = fitz.open(file_path)
-            for page_num, page in enumerate(doc):
-                page_text = page.get_text()
-                ocr_text = ""
-                for img in page.get_images(full=True):
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    try:
-                        image = Image.open(io.BytesIO(base_image["image"]))
-                        ocr_text += pytesseract.image_to_string(image) + "\n"
-                    except:
-                        pass
+            import fitz  # PyMuPDF
+            path = source_path(source)
+            doc = fitz.open(path, filetype="pdf") if path else fitz.open(stream=source.read(), filetype="pdf")
+            for page_num, page_text, ocr_text in metrics.timed_iter(ocr_pdf_pages(doc), 'extract_page', 'pdf'):
                 combined = page_text + "\n" + ocr_text
                 if combined.strip():
-                    chunks.append({'page_number': page_num+1, 'content': combined})
-        except:
-            return []
+                    yield page_num + 1, combined
+                if on_page:
+                    on_page(page_num + 1, doc.page_count)
+        except Exception as e:
+            # Never let a half-read file pass for a complete new version
+            raise ValueError(f"Could not read PDF {filename}: {e}") from e
+        finally:
+            if doc is not None:
+                doc.close()
 
-    elif file_path.endswith('.docx'):
+    elif extension == '.docx':
         try:
-            doc_obj = docx.Document(file_path)
+            import docx
+            with metrics.span('extract_page', 'docx'):
+                doc_obj = docx.Document(source)
             for para in doc_obj.paragraphs:
                 if para.text.strip():
-                    chunks.append({'page_number': 1, 'content': para.text})
-        except:
-            return []
+                    yield 1, para.text
+            if on_page:
+                on_page(1, 1)
+        except Exception as e:
+            raise ValueError(f"Could not read DOCX {filename}: {e}") from e
+
+
+def _iter_paragraphs(source):
+    # Same paragraphs as text.split('\n\n'), decoded a block at a time. A run of
+    # text with no blank line is cut at _MAX_PARAGRAPH_CHARS so memory stays bounded.
+    if isinstance(source, str):
+        f = open(source, 'r', encoding='utf-8')
+    else:
+        f = io.TextIOWrapper(source, encoding='utf-8')
+    try:
+        buffer = ""
+        while True:
+            block = f.read(_TEXT_BLOCK_CHARS)
+            if not block:
+                break
+            buffer += block
+            *paragraphs, buffer = buffer.split('\n\n')
+            yield from paragraphs
+            while len(buffer) > _MAX_PARAGRAPH_CHARS:
+                cut = buffer.rfind(' ', 0, _MAX_PARAGRAPH_CHARS) + 1 or _MAX_PARAGRAPH_CHARS
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+        yield buffer
+    finally:
+        if isinstance(source, str):
+            f.close()
+        else:
+            f.detach()  # the caller owns (and closes) the underlying file
+
+
+def _count_tokens(text):
+    # Count with the embedding model's own tokenizer so chunks really fit its window
+    tokenizer = getattr(get_embedding_model(), 'tokenizer', None)
+    if tokenizer is None:
+        return approx_token_count(text)
+    return len(tokenizer.tokenize(text))
+
+
+def ingest_document(source, filename, user_id=DEFAULT_USER_ID, doc_id=None, report=None):
+    """Extracts, embeds and stores one uploaded file. Runs on an ingestion worker.
+
+    ``source`` is the file's path or an open binary file (the caller closes it).
+    The file becomes document ``doc_id`` (default: ``filename``) of ``user_id``.
+    Chunk ids are content hashes, so the upload is diffed against what that
+    document already has stored: only new or changed chunks are embedded, unchanged ones
+    are kept (with refreshed page numbers), and chunks that no longer appear
+    are deleted. Work happens INGEST_BATCH_SIZE chunks at a time as extraction
+    produces them, so memory stays flat however long the file is.
+
+    ``report(**fields)`` receives progress updates (pages and chunks done so far).
+    Returns ``{'chunks_total', 'chunks_added', 'chunks_reused', 'chunks_deleted', 'timings'}``,
+    where ``timings`` splits the work into extract / embed / store milliseconds.
+    """
+    report = report or (lambda **fields: None)
+    doc_id = doc_id or filename
+    with _document_lock(user_id, doc_id):
+        return _ingest(source, filename, user_id, doc_id, report)
+
+
+@contextlib.contextmanager
+def _document_lock(user_id, doc_id):
+    # Held while a document is ingested. The entry is dropped once nobody
+    # holds or waits for it, so the dict only ever has documents in flight.
+    key = (user_id, doc_id)
+    with _collections_lock:
+        entry = _ingest_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _collections_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _ingest_locks[key]
+
+
+def _ingest(source, filename, user_id, doc_id, report):
+    doc_collection, chat_collection = get_collections(user_id)
+    bm25 = get_bm25_index(user_id) if _hybrid_search else None
+    doc = _begin_document(doc_collection, user_id, filename, doc_id)
+    stats = doc['stats']
+    timings = stats['timings'] = {'extract_ms': 0.0, 'embed_ms': 0.0, 'store_ms': 0.0}
+
+    metrics.log(f"Extracting text from {filename}...")
+    start = time.perf_counter()
+    chunks = extract_text(
+        source,
+        filename,
+        on_page=lambda done, total: report(pages_extracted=done, pages_total=total)
+    )
+
+    batch = []
+    try:
+        for chunk in chunks:
+            _add_chunk(doc, chunk, batch)
+            if len(batch) >= _ingest_batch_size:
+                _upsert_chunks(batch, doc_collection, bm25, timings)
+                batch = []
+                report(chunks_total=stats['chunks_total'], chunks_embedded=stats['chunks_added'],
+                       chunks_reused=stats['chunks_reused'])
+        if batch:
+            _upsert_chunks(batch, doc_collection, bm25, timings)
+            report(chunks_total=stats['chunks_total'], chunks_embedded=stats['chunks_added'],
+                   chunks_reused=stats['chunks_reused'])
+    except Exception as e:
+        doc['error'] = str(e)
+        _finish_document(doc, doc_collection, chat_collection, bm25, user_id)
+        if bm25 is not None:
+            bm25.save()
+        raise
+    # Extraction runs lazily inside the loop, so it is whatever embedding and storing didn't take
+    timings['extract_ms'] = round((time.perf_counter() - start) * 1000 - timings['embed_ms'] - timings['store_ms'], 1)
+
+    _finish_document(doc, doc_collection, chat_collection, bm25, user_id)
+    if bm25 is not None and stats['chunks_total']:
+        bm25.save()
+    return stats
+
+
+def ingest_documents(items, user_id=DEFAULT_USER_ID, report=None):
+    """Ingests several files as one operation. Runs on an ingestion worker.
+
+    ``items`` is a list of ``(source, filename, doc_id)``. Up to
+    BULK_EXTRACT_WORKERS files are extracted in parallel, and their chunks
+    share embedding batches and Chroma writes of BULK_INGEST_BATCH_SIZE, so
+    many small handouts cost a few large model calls rather than one each.
+    Every file is diffed against its stored version exactly as in
+    ingest_document(). A ``source`` may also be a zero-argument callable
+    that opens the file; it is called when an extraction thread reaches the
+    file, and what it returns is closed right after, so only the files being
+    extracted are held open at once.
+
+    ``report(**fields)`` receives ``files`` (the per-file results so far) and
+    running chunk totals. Returns ``(results, timings)``: one result dict per
+    item, in order, and the extract / embed / store milliseconds for the whole batch.
+    """
+    report = report or (lambda **fields: None)
+    results, unique = [], {}
+    for source, filename, doc_id in items:
+        result = {'filename': filename, 'doc_id': doc_id, 'status': 'queued', 'error': None,
+                  'pages_total': 0, 'pages_extracted': 0}
+        if doc_id in unique:
+            result.update(status='failed', error="Another file in this upload has the same document id.")
+        else:
+            unique[doc_id] = (source, result)
+        results.append(result)
+
+    # Take the per-document locks in a fixed order so two bulk jobs can't deadlock
+    with contextlib.ExitStack() as stack:
+        for doc_id in sorted(unique):
+            stack.enter_context(_document_lock(user_id, doc_id))
+        timings = _ingest_many(list(unique.values()), user_id, report, results)
+    return results, timings
+
+
+def _ingest_many(entries, user_id, report, results):
+    doc_collection, chat_collection = get_collections(user_id)
+    bm25 = get_bm25_index(user_id) if _hybrid_search else None
+    timings = {'extract_ms': 0.0, 'embed_ms': 0.0, 'store_ms': 0.0}
+    docs = []
+    for source, result in entries:
+        doc = _begin_document(doc_collection, user_id, result['filename'], result['doc_id'])
+        doc.update(source=source, result=result, error=None)
+        docs.append(doc)
+    if not docs:
+        return timings
+
+    chunk_queue = queue.Queue(maxsize=_bulk_batch_size * 2)
+    cancelled = threading.Event()
+
+    def produce(doc):
+        doc['result']['status'] = 'running'
+        opened = None
+        try:
+            source = doc['source']
+            if callable(source):
+                source = opened = source()
+            on_page = lambda done, total: doc['result'].update(pages_extracted=done, pages_total=total)
+            for chunk in extract_text(source, doc['filename'], on_page=on_page):
+                if not _put_unless_cancelled(chunk_queue, (doc, chunk), cancelled):
+                    return
+        except Exception as e:
+            metrics.log(f"Error extracting {doc['filename']}: {e}")
+            doc['error'] = str(e)
+        finally:
+            if opened is not None:
+                opened.close()
+            _put_unless_cancelled(chunk_queue, (doc, None), cancelled)
+
+    def flush():
+        if batch:
+            _upsert_chunks(batch, doc_collection, bm25, timings)
+            batch.clear()
+        # Every chunk of an extracted file is stored by now, so its stale chunks can go
+        for doc in extracted:
+            _finish_document(doc, doc_collection, chat_collection, bm25, user_id)
+            doc['finished'] = True
+        extracted.clear()
+        report(files=[dict(r) for r in results],
+               chunks_total=sum(d['stats']['chunks_total'] for d in docs),
+               chunks_embedded=sum(d['stats']['chunks_added'] for d in docs),
+               chunks_reused=sum(d['stats']['chunks_reused'] for d in docs))
+
+    batch, extracted = [], []
+    start = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=min(_bulk_extract_workers, len(docs)), thread_name_prefix="bulk-extract")
+    try:
+        for doc in docs:
+            pool.submit(metrics.bind(produce), doc)
+        remaining = len(docs)
+        while remaining:
+            doc, chunk = chunk_queue.get()
+            if chunk is None:
+                remaining -= 1
+                extracted.append(doc)
+                if not batch:
+                    flush()
+                continue
+            _add_chunk(doc, chunk, batch)
+            if len(batch) >= _bulk_batch_size:
+                flush()
+        flush()
+    except Exception as e:
+        # Storing failed: nothing unfinished may replace its previous version
+        for doc in docs:
+            if not doc.get('finished'):
+                doc['error'] = doc.get('error') or str(e)
+                _finish_document(doc, doc_collection, chat_collection, bm25, user_id)
+        if bm25 is not None:
+            bm25.save()
+        raise
+    finally:
+        cancelled.set()
+        pool.shutdown(wait=True)
+
+    if bm25 is not None:
+        bm25.save()
+    timings['extract_ms'] = round((time.perf_counter() - start) * 1000 - timings['embed_ms'] - timings['store_ms'], 1)
+    return timings
+
+
+def _put_unless_cancelled(q, item, cancelled):
+    # Producers give up once the consumer has stopped, instead of blocking on a full queue
+    while not cancelled.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _begin_document(doc_collection, user_id, filename, doc_id):
+    # Answers about this document stop being served as soon as it starts changing
+    _answer_cache.invalidate(user_id, doc_id)
+    return {
+        'filename': filename,
+        'user_id': user_id,
+        'doc_id': doc_id,
+        'existing_ids': set(doc_collection.get(where=_doc_filter(doc_id), include=[])['ids']),
+        'seen_ids': set(),
+        'occurrences': {},
+        'stats': {'chunks_total': 0, 'chunks_added': 0, 'chunks_reused': 0, 'chunks_deleted': 0},
+    }
+
+
+def _add_chunk(doc, chunk, batch):
+    chunk_id = _chunk_id(doc['doc_id'], chunk['content'], doc['occurrences'])
+    doc['seen_ids'].add(chunk_id)
+    batch.append((chunk_id, chunk, doc))
+
+
+def _finish_document(doc, doc_collection, chat_collection, bm25, user_id):
+    """Completes the document once all of its chunks are stored. The caller saves ``bm25``.
+
+    A complete extraction replaces the previous version: chunks it no longer
+    has are deleted and, if any chunk was added or deleted, the old
+    conversation about it is cleared. A failed one rolls back the chunks it
+    added and leaves the previous version as it was.
+    """
+    stats = doc['stats']
+    result = doc.get('result')
+    if doc.get('error'):
+        _roll_back_document(doc, doc_collection, bm25)
+        if result is not None:
+            result.update(stats, status='failed', error=doc['error'])
+        return stats
+    if not stats['chunks_total']:
+        # No text found: leave the previous version in place
+        if result is not None:
+            result.update(stats, status='empty')
+        return stats
+
+    stale_ids = list(doc['existing_ids'] - doc['seen_ids'])
+    for start in range(0, len(stale_ids), _ingest_batch_size):
+        doc_collection.delete(ids=stale_ids[start:start + _ingest_batch_size])
+    stats['chunks_deleted'] = len(stale_ids)
+    if bm25 is not None:
+        bm25.remove(stale_ids)
+
+    # Re-uploading an identical file keeps the conversation about it
+    if stats['chunks_added'] or stats['chunks_deleted']:
+        try:
+            chat_collection.delete(where=_doc_filter(doc['doc_id']))
+            metrics.log(f"Cleared old chat data for {doc['doc_id']}.")
+        except Exception as e:
+            metrics.log(f"Could not clear chat collection (it might be empty): {e}")
+    # ...and anything cached by a question that raced with the ingestion goes too
+    _answer_cache.invalidate(user_id, doc['doc_id'])
+
+    if result is not None:
+        result.update(stats, status='done')
+    metrics.log(f"Ingested {doc['filename']} as {user_id}/{doc['doc_id']}: {stats}")
+    return stats
+
+
+def _roll_back_document(doc, doc_collection, bm25):
+    added_ids = list(doc['seen_ids'] - doc['existing_ids'])
+    try:
+        for start in range(0, len(added_ids), _ingest_batch_size):
+            doc_collection.delete(ids=added_ids[start:start + _ingest_batch_size])
+        if bm25 is not None:
+            bm25.remove(added_ids)
+    except Exception as e:
+        metrics.log(f"Could not roll back {doc['filename']}: {e}")
+    doc['stats']['chunks_added'] = 0
+    _answer_cache.invalidate(doc['user_id'], doc['doc_id'])
+
+
+def _chunk_id(doc_id, content, occurrences):
+    # Same text -> same id across uploads; repeats within one file get a suffix
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
+    occurrences[digest] = occurrences.get(digest, 0) + 1
+    n = occurrences[digest]
+    return f"{doc_id}:{digest}" if n == 1 else f"{doc_id}:{digest}_{n}"
+
+
+def _upsert_chunks(batch, doc_collection, bm25, timings):
+    # ``batch`` holds (chunk_id, chunk, doc) and may mix chunks of several documents
+    start = time.perf_counter()
+    embed_ms = 0.0
+    new = [item for item in batch if item[0] not in item[2]['existing_ids']]
+    reused = [item for item in batch if item[0] in item[2]['existing_ids']]
+
+    if new:
+        documents = [chunk['content'] for _, chunk, _ in new]
+        embed_start = time.perf_counter()
+        embeddings = embed_texts(documents)
+        embed_ms = (time.perf_counter() - embed_start) * 1000
+        doc_collection.add(
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=[_chunk_metadata(chunk, doc['filename'], doc['doc_id']) for _, chunk, doc in new],
+            ids=[chunk_id for chunk_id, _, _ in new]
+        )
+        if bm25 is not None:
+            bm25.add([chunk_id for chunk_id, _, _ in new], documents, [doc['doc_id'] for _, _, doc in new])
+    if reused:
+        # Unchanged text may have moved to another page; metadata updates don't re-embed
+        doc_collection.update(
+            ids=[chunk_id for chunk_id, _, _ in reused],
+            metadatas=[_chunk_metadata(chunk, doc['filename'], doc['doc_id']) for _, chunk, doc in reused]
+        )
 
-    return chunks
+    for _, _, doc in batch:
+        doc['stats']['chunks_total'] += 1
+    for _, _, doc in new:
+        doc['stats']['chunks_added'] += 1
+    for _, _, doc in reused:
+        doc['stats']['chunks_reused'] += 1
+    timings['embed_ms'] = round(timings['embed_ms'] + embed_ms, 1)
+    timings['store_ms'] = round(timings['store_ms'] + (time.perf_counter() - start) * 1000 - embed_ms, 1)
 
 
-def get_answer(query_text):
-    global embedding_model, doc_collection
+def _chunk_metadata(chunk, filename, doc_id):
+    return {'page': chunk['page_number'], 'page_end': chunk['page_end'], 'source': filename, 'doc_id': doc_id}
 
+
+def embed_texts(texts):
+    """Embeds ``texts`` with ``embedding_model``, EMBED_BATCH_SIZE at a time.
+
+    Document chunks, queries and memory entries all go through here so their
+    vectors are comparable; Chroma's built-in embedding function is never used.
+    """
+    metrics.EMBEDDED_TEXTS.inc(len(texts))
+    with metrics.span('embed'):
+        return get_embedding_model().encode(texts, batch_size=_embed_batch_size).tolist()
+
+
+def embed_query(query_text):
+    """Embedding of a single query, served from the LRU cache when the same question was seen before."""
+    key = normalize_query(query_text)
+    vector = _query_cache.get(key)
+    if vector is None:
+        vector = embed_texts([query_text])[0]
+        _query_cache.put(key, vector)
+    return vector
+
+
+def embed_queries(query_texts):
+    """Embeddings of several queries, in order.
+
+    Queries already in the LRU cache are served from it; all the others go to
+    the model in one embed_texts() call.
+    """
+    keys = [normalize_query(text) for text in query_texts]
+    vectors = [_query_cache.get(key) for key in keys]
+    missing = {}
+    for text, key, vector in zip(query_texts, keys, vectors):
+        if vector is None:
+            missing.setdefault(key, text)
+    if missing:
+        fresh = dict(zip(missing, embed_texts(list(missing.values()))))
+        for key, vector in fresh.items():
+            _query_cache.put(key, vector)
+        vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+    return vectors
+
+
+def query_embedding_cache_stats():
+    return _query_cache.stats()
+
+
+def answer_cache_stats():
+    return _answer_cache.stats()
+
+
+def get_answer(query_text, user_id=DEFAULT_USER_ID, doc_id=None, query_embedding=None, timings=None):
+    """Retrieves context for ``query_text``; returns ``(context_str, sources)``."""
     context_str = ""
     sources = []
 
     try:
-        query_embedding = embedding_model.encode([query_text]).tolist()
-        results = doc_collection.query(query_embeddings=query_embedding, n_results=3)
-
-        for i in range(len(results['documents'][0])):
-            doc = results['documents'][0][i]
-            meta = results['metadatas'][0][i]
+        for doc, meta in retrieve_documents(query_text, user_id, doc_id, query_embedding, timings):
             context_str += f"Context from Page {meta['page']}:\n{doc}\n---\n"
             sources.append(meta)
 
@@ -110,11 +823,99 @@ def get_answer(query_text):
     return context_str, sources
 
 
+def retrieve_documents(query_text, user_id=DEFAULT_USER_ID, doc_id=None, query_embedding=None, timings=None):
+    """Returns the ranked ``(document, metadata)`` chunks for ``query_text``.
+
+    With RERANK_ENABLED a wider candidate set is scored by the cross-encoder
+    and its time is recorded in ``timings['rerank_ms']``.
+    """
+    doc_collection, _ = get_collections(user_id)
+    if query_embedding is None:
+        query_embedding = embed_query(query_text)
+    n_candidates = _candidate_count()
+    results = doc_collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_candidates,
+        where=_doc_filter(doc_id)
+    )
+    hits = list(zip(results['ids'][0], results['documents'][0], results['metadatas'][0]))
+    return _rank_hits(query_text, hits, doc_collection, user_id, doc_id, n_candidates, timings)
+
+
+def _candidate_count():
+    # How many dense hits to fetch before fusion / reranking cut them to RETRIEVAL_TOP_K
+    if rerankServices.enabled:
+        return max(_retrieval_candidates, rerankServices.candidates)
+    return _retrieval_candidates if _hybrid_search else _top_k
+
+
+def _rank_hits(query_text, hits, doc_collection, user_id, doc_id, n_candidates, timings):
+    # Dense ``(id, document, metadata)`` hits -> final ``(document, metadata)`` list
+    if _hybrid_search:
+        hits = _fuse_with_bm25(query_text, hits, doc_collection, user_id, doc_id, n_candidates)
+
+    if rerankServices.enabled:
+        hits, rerank_ms = rerankServices.rerank(query_text, hits[:n_candidates], _top_k)
+        if timings is not None:
+            timings['rerank_ms'] = rerank_ms
+    else:
+        hits = hits[:_top_k]
+
+    return [(doc, meta) for _, doc, meta in hits]
+
+
+def _fuse_with_bm25(query_text, vector_hits, doc_collection, user_id, doc_id, n_candidates):
+    """Merges dense hits with BM25 hits by reciprocal rank fusion.
+
+    ``vector_hits`` is a ranked list of ``(id, document, metadata)``; the fused
+    list has the same shape. Chunks only the lexical side found are fetched
+    from Chroma by id.
+    """
+    lexical = get_bm25_index(user_id).search(query_text, n_candidates, doc_id)
+
+    scores = {}
+    for ranking in ([hit[0] for hit in vector_hits], [chunk_id for chunk_id, _ in lexical]):
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (_rrf_k + rank + 1)
+
+    by_id = {hit[0]: hit for hit in vector_hits}
+    missing = [chunk_id for chunk_id, _ in lexical if chunk_id not in by_id]
+    if missing:
+        fetched = doc_collection.get(ids=missing, include=['documents', 'metadatas'])
+        for hit in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+            by_id[hit[0]] = hit
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [by_id[chunk_id] for chunk_id in ranked if chunk_id in by_id]
+
+
+def _needs_rewrite(query_text):
+    """Cheap local check for follow-ups that only make sense with the conversation.
+
+    "Define entropy" is self-contained; "why is it increasing?" or "and the
+    second one?" lean on earlier turns and go to the LLM rewrite.
+    """
+    return bool(_ANAPHORA_RE.search(query_text) or _FOLLOWUP_RE.search(query_text))
+
+
 def _rewrite_query(query_text, chat_history):
     if not chat_history:
         return query_text
 
-    formatted_history = "\n".join([f"{msg['role']}: {msg['parts']}" for msg in chat_history])
+    _count_rewrite('requests')
+    if not _needs_rewrite(query_text):
+        _count_rewrite('skipped')
+        return query_text
+
+    # Resolving a follow-up only needs the latest turns; keeps this prompt bounded too
+    recent = chat_history[-_prompt_recent_turns:] if _prompt_recent_turns else []
+    formatted_history = "\n".join([f"{msg['role']}: {msg['parts']}" for msg in recent])
+    memo_key = (hashlib.sha1(formatted_history.encode('utf-8')).hexdigest(), normalize_query(query_text))
+    rewritten = _rewrite_memo.get(memo_key)
+    if rewritten is not None:
+        _count_rewrite('memo_hits')
+        return rewritten
+
     prompt = f"""
     Rewrite user question using conversation:
     {formatted_history}
@@ -123,43 +924,330 @@ def _rewrite_query(query_text, chat_history):
     """
 
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        _count_rewrite('llm_calls')
+        with metrics.span('generate', 'rewrite'):
+            response = get_generative_model().generate_content(prompt)
+        rewritten = response.text.strip()
     except:
         return query_text
 
+    _rewrite_memo.put(memo_key, rewritten)
+    return rewritten
+
 
-def _retrieve_relevant_history(query_text, k=3):
-    global embedding_model, chat_collection
+def _count_rewrite(counter):
+    with _rewrite_stats_lock:
+        _rewrite_stats[counter] += 1
+
+
+def rewrite_stats():
+    with _rewrite_stats_lock:
+        stats = dict(_rewrite_stats)
+    stats['skip_rate'] = round(stats['skipped'] / stats['requests'], 3) if stats['requests'] else 0.0
+    return stats
+
+
+def _retrieve_relevant_history(query_text, user_id=DEFAULT_USER_ID, doc_id=None, k=3, query_embedding=None):
     try:
-        query_embedding = embedding_model.encode([query_text]).tolist()
-        results = chat_collection.query(query_embeddings=query_embedding, n_results=k)
-        return "\n---\n".join(results['documents'][0]) if results['documents'] else ""
+        return "\n---\n".join(_retrieve_memory(query_text, user_id, doc_id, k, query_embedding))
     except:
         return ""
 
 
-def _store_in_long_term_memory(user_msg, bot_msg):
-    global chat_collection
-    text = f"User: {user_msg}\nAssistant: {bot_msg}"
-    chat_collection.add(documents=[text], metadatas=[{"page": 0}], ids=[f"chat_{int(time.time())}"])
+def _retrieve_memory(query_text, user_id=DEFAULT_USER_ID, doc_id=None, k=3, query_embedding=None):
+    # Long-term memory snippets closest to the query, best first
+    _, chat_collection = get_collections(user_id)
+    if query_embedding is None:
+        query_embedding = embed_query(query_text)
+    results = chat_collection.query(query_embeddings=[query_embedding], n_results=k, where=_doc_filter(doc_id))
+    return results['documents'][0] if results['documents'] else []
 
 
-def get_conversational_answer(query_text, chat_history):
-    rewritten_query = _rewrite_query(query_text, chat_history)
-    document_context, sources = get_answer(rewritten_query)
-    long_term = _retrieve_relevant_history(rewritten_query)
-    formatted_history = "\n".join([f"{msg['role']}: {msg['parts']}" for msg in chat_history])
+def _store_in_long_term_memory(user_msg, bot_msg, user_id=DEFAULT_USER_ID, doc_id=None):
+    """Queues the turn for long-term memory and returns immediately.
 
-    prompt = f"""
-    DOCUMENT:
-    {document_context}
-    LONG TERM:
-    {long_term}
-    RECENT CHAT:
-    {formatted_history}
-    LATEST QUESTION: {query_text}
+    The write-behind buffer embeds and adds queued turns in batches off the
+    response path; call flush_long_term_memory() to wait for them.
     """
+    _memory_buffer.put({
+        'user_id': user_id,
+        'doc_id': doc_id or "",
+        'text': f"User: {user_msg}\nAssistant: {bot_msg}",
+        'ts': time.time()
+    })
+
+
+def flush_long_term_memory(timeout=10.0):
+    return _memory_buffer.flush(timeout) if _memory_buffer else True
+
+
+def _write_memory_batch(entries):
+    # One embedding call for the whole batch, then one add per user collection
+    vectors = embed_texts([entry['text'] for entry in entries])
+    by_user = {}
+    for entry, vector in zip(entries, vectors):
+        by_user.setdefault(entry['user_id'], []).append((entry, vector))
+
+    for user_id, items in by_user.items():
+        _, chat_collection = get_collections(user_id)
+        chat_collection.add(
+            documents=[entry['text'] for entry, _ in items],
+            embeddings=[vector for _, vector in items],
+            metadatas=[{"page": 0, "doc_id": entry['doc_id'], "ts": entry['ts'], "kind": "turn"} for entry, _ in items],
+            ids=[f"chat_{uuid.uuid4().hex}" for _ in items]
+        )
+
+
+def _start_retrieval(query_text, user_id, doc_id, timings):
+    # The query is embedded once and shared; document and memory retrieval
+    # don't depend on each other, so they run side by side
+    try:
+        query_embedding = embed_query(query_text)
+    except Exception as e:
+        metrics.log(f"Could not embed query: {e}")
+        query_embedding = None  # each retriever retries and degrades on its own
+    return (
+        _stage_pool.submit(metrics.bind(retrieve_documents), query_text, user_id, doc_id, query_embedding, timings),
+        _stage_pool.submit(metrics.bind(_retrieve_memory), query_text, user_id, doc_id, 3, query_embedding)
+    )
+
+
+def _stage_result(future, timeout, default, fallback=None):
+    """Waits up to ``timeout`` seconds for a stage; returns ``(result, finished)``.
+
+    On timeout or error, falls back to ``fallback`` (a finished speculative
+    run of the same stage) if there is one, else to ``default``, and
+    ``finished`` is False.
+    """
+    try:
+        return future.result(timeout=timeout), True
+    except Exception as e:
+        metrics.log(f"Stage did not finish ({type(e).__name__}: {e}), falling back.")
+    if fallback is not None and fallback.done() and fallback.exception() is None:
+        return fallback.result(), False
+    return default, False
+
+
+def _build_prompt(query_text, chat_history, user_id, doc_id):
+    """Runs the rewrite and retrieval stages and assembles the generation prompt.
+
+    Retrieval on the raw question starts speculatively while the rewrite is
+    in flight; if the rewrite comes back unchanged (or times out) those results
+    are used as-is, otherwise retrieval is re-run on the rewritten question.
+    The prompt is packed to PROMPT_TOKEN_BUDGET by pack_prompt().
+    Returns ``(prompt, sources, timings, prompt_tokens, complete)``;
+    ``complete`` is False when a stage timed out or failed and the prompt was
+    built from fallback (or no) context.
+    """
+    timings = {}
+    start = time.perf_counter()
+    rewrite = _stage_pool.submit(metrics.bind(_rewrite_query), query_text, chat_history) if chat_history else None
+    speculative = _start_retrieval(query_text, user_id, doc_id, timings)
+
+    rewritten_query = query_text
+    if rewrite is not None:
+        rewritten_query, _ = _stage_result(rewrite, _rewrite_timeout, query_text)
+        timings['rewrite_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+    if rewritten_query == query_text:
+        retrieval, fallbacks = speculative, (None, None)
+    else:
+        retrieval, fallbacks = _start_retrieval(rewritten_query, user_id, doc_id, timings), speculative
+
+    deadline = time.perf_counter() + _retrieval_timeout
+    doc_hits, docs_finished = _stage_result(retrieval[0], _retrieval_timeout, [], fallbacks[0])
+    memory, memory_finished = _stage_result(retrieval[1], max(0.0, deadline - time.perf_counter()), [], fallbacks[1])
+    timings['retrieval_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+    prompt, sources, prompt_tokens = pack_prompt(
+        query_text, doc_hits, memory, chat_history, _prompt_token_budget, _prompt_recent_turns)
+    return prompt, sources, timings, prompt_tokens, docs_finished and memory_finished
+
+
+def _answer_cache_lookup(query_text, chat_history, user_id, doc_id):
+    """Returns ``(cache_key, cached_result)``; both None when the cache doesn't apply.
+
+    Only self-contained questions (no chat history) are cached, since the
+    answer to a follow-up depends on the conversation.
+    """
+    if chat_history:
+        return None, None
+    try:
+        key = (_answer_cache.scope(user_id, doc_id), embed_query(query_text))
+    except Exception as e:
+        metrics.log(f"Answer cache unavailable: {e}")
+        return None, None
+    return key, _answer_cache.lookup(*key)
+
+
+def get_conversational_answer(query_text, chat_history, user_id=DEFAULT_USER_ID, doc_id=None):
+    cache_key, cached = _answer_cache_lookup(query_text, chat_history, user_id, doc_id)
+    if cached:
+        return {**cached, 'cached': True}
+
+    prompt, sources, timings, prompt_tokens, complete = _build_prompt(query_text, chat_history, user_id, doc_id)
+    start = time.perf_counter()
+    with metrics.span('generate', 'answer'):
+        response = get_generative_model().generate_content(prompt)
+    timings['generation_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+    result = {'answer': response.text, 'sources': sources}
+    # An answer built without its context must not be served again for an hour
+    if cache_key and complete:
+        _answer_cache.store(*cache_key, result)
+    return {**result, 'timings': timings, 'prompt_tokens': prompt_tokens}
+
+
+def stream_conversational_answer(query_text, chat_history, user_id=DEFAULT_USER_ID, doc_id=None):
+    """Like get_conversational_answer, but yields ``(event, payload)`` pairs as they become available.
+
+    ``('sources', [...])`` comes first, as soon as retrieval is done, followed
+    by one ``('token', text)`` per chunk Gemini streams back and finally
+    ``('prompt_tokens', {...})``, the pack_prompt() breakdown. A cached answer
+    is sent as a single token, without a breakdown (as in /ask).
+    """
+    cache_key, cached = _answer_cache_lookup(query_text, chat_history, user_id, doc_id)
+    if cached:
+        yield 'sources', cached['sources']
+        yield 'token', cached['answer']
+        return
+
+    prompt, sources, _, prompt_tokens, complete = _build_prompt(query_text, chat_history, user_id, doc_id)
+    yield 'sources', sources
+    parts = []
+    start = time.perf_counter()
+    for chunk in get_generative_model().generate_content(prompt, stream=True):
+        if chunk.text:
+            if not parts:
+                metrics.observe('generate', time.perf_counter() - start, 'stream_first_token')
+            parts.append(chunk.text)
+            yield 'token', chunk.text
+    metrics.observe('generate', time.perf_counter() - start, 'stream')
+    yield 'prompt_tokens', prompt_tokens
+
+    if cache_key and complete:
+        _answer_cache.store(*cache_key, {'answer': "".join(parts), 'sources': sources})
+
+
+def answer_batch(questions, user_id=DEFAULT_USER_ID):
+    """Answers several independent questions at once, e.g. a generated quiz.
+
+    ``questions`` is a list of ``{'query', 'history', 'doc_id'}``. Follow-ups
+    are rewritten concurrently, every question is embedded in one encode
+    call, and the Chroma queries are batched: one per collection and
+    document filter instead of two per question. Answer-cache hits skip the
+    rest; the remaining prompts are generated on the ASK_BATCH_CONCURRENCY
+    pool. Returns ``(results, timings)`` where ``results`` holds one
+    ``{'query', 'answer', 'sources', 'cached'}`` per question, in order, or
+    ``{'query', 'error'}`` for a question that failed. Generated answers
+    also carry ``prompt_tokens``, the pack_prompt() breakdown.
+    """
+    results = [None] * len(questions)
+    timings = {}
+    start = time.perf_counter()
+
+    rewrites = [_stage_pool.submit(metrics.bind(_rewrite_query), q['query'], q['history']) if q['history'] else None
+                for q in questions]
+    search_texts = [q['query'] for q in questions]
+    if any(rewrites):
+        # One deadline for all of them; a rewrite still running then falls back to the raw question
+        wait([future for future in rewrites if future], timeout=_rewrite_timeout)
+        for i, future in enumerate(rewrites):
+            if future is not None and future.done() and future.exception() is None:
+                search_texts[i] = future.result()
+        timings['rewrite_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+    try:
+        vectors = embed_queries([q['query'] for q in questions] + search_texts)
+    except Exception as e:
+        metrics.log(f"Could not embed batch: {e}")
+        return [{'query': q['query'], 'error': f"Could not embed question: {e}"} for q in questions], timings
+    query_vectors, search_vectors = vectors[:len(questions)], vectors[len(questions):]
+
+    pending = []
+    for i, q in enumerate(questions):
+        cache_key = None
+        if not q['history']:
+            cache_key = (_answer_cache.scope(user_id, q['doc_id']), query_vectors[i])
+            cached = _answer_cache.lookup(*cache_key)
+            if cached:
+                results[i] = {'query': q['query'], **cached, 'cached': True}
+                continue
+        pending.append((i, cache_key))
+
+    doc_hits, memories, complete = _retrieve_batch(
+        [(search_texts[i], search_vectors[i], questions[i]['doc_id']) for i, _ in pending], user_id)
+    timings['retrieval_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+    generations = []
+    for (i, cache_key), hits, memory, finished in zip(pending, doc_hits, memories, complete):
+        q = questions[i]
+        if not finished:
+            cache_key = None
+        prompt, sources, prompt_tokens = pack_prompt(
+            q['query'], hits, memory, q['history'], _prompt_token_budget, _prompt_recent_turns)
+        generations.append((i, cache_key, sources, prompt_tokens,
+                            _batch_pool.submit(metrics.bind(_generate_answer), prompt)))
+
+    for i, cache_key, sources, prompt_tokens, future in generations:
+        try:
+            result = {'answer': future.result(), 'sources': sources}
+        except Exception as e:
+            metrics.log(f"Generation failed for batch item {i}: {e}")
+            results[i] = {'query': questions[i]['query'], 'error': str(e)}
+            continue
+        if cache_key:
+            _answer_cache.store(*cache_key, result)
+        results[i] = {'query': questions[i]['query'], **result, 'cached': False, 'prompt_tokens': prompt_tokens}
+    timings['total_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return results, timings
+
+
+def _retrieve_batch(queries, user_id):
+    """Document hits and memory snippets for each ``(query_text, vector, doc_id)``, in order.
+
+    A Chroma query applies one ``where`` filter to all its embeddings, so
+    queries are grouped by document and each group is one query per
+    collection. BM25 fusion and reranking still run per question. A failed
+    lookup leaves that group without context rather than failing it.
+    Returns ``(doc_hits, memories, complete)``; ``complete[i]`` is False when
+    a lookup for query ``i`` failed.
+    """
+    doc_hits = [[] for _ in queries]
+    memories = [[] for _ in queries]
+    complete = [True] * len(queries)
+    if not queries:
+        return doc_hits, memories, complete
+    doc_collection, chat_collection = get_collections(user_id)
+    n_candidates = _candidate_count()
+
+    groups = {}
+    for index, (_, _, doc_id) in enumerate(queries):
+        groups.setdefault(doc_id, []).append(index)
+
+    for doc_id, indexes in groups.items():
+        vectors = [queries[index][1] for index in indexes]
+        try:
+            results = doc_collection.query(query_embeddings=vectors, n_results=n_candidates, where=_doc_filter(doc_id))
+            for index, ids, documents, metadatas in zip(indexes, results['ids'], results['documents'],
+                                                        results['metadatas']):
+                doc_hits[index] = _rank_hits(queries[index][0], list(zip(ids, documents, metadatas)),
+                                             doc_collection, user_id, doc_id, n_candidates, None)
+        except Exception as e:
+            metrics.log(f"Batch retrieval failed for {doc_id or 'all documents'}: {e}")
+            for index in indexes:
+                complete[index] = False
+        try:
+            results = chat_collection.query(query_embeddings=vectors, n_results=3, where=_doc_filter(doc_id))
+            for index, documents in zip(indexes, results['documents'] or []):
+                memories[index] = documents
+        except Exception as e:
+            metrics.log(f"Batch memory lookup failed for {doc_id or 'all documents'}: {e}")
+            for index in indexes:
+                complete[index] = False
+    return doc_hits, memories, complete
+
 
-    response = model.generate_content(prompt)
-    return {'answer': response.text, 'sources': sources}
+def _generate_answer(prompt):
+    with metrics.span('generate', 'answer'):
+        return get_generative_model().generate_content(prompt).text
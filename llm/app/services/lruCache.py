@@ -0,0 +1,44 @@
+# lruCache.py
+# Bounded in-process LRU with hit/miss counters. Used for query embeddings
+# (keyed by normalized query text), memoized query rewrites, and the
+# per-user Chroma collections and BM25 indexes a worker keeps loaded.
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    # all-MiniLM-L6-v2 is uncased, so case and spacing don't change the vector
+    return " ".join(text.lower().split())
+
+
+class LruCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'max_entries': self.max_entries}
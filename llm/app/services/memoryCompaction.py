@@ -0,0 +1,178 @@
+# memoryCompaction.py
+# Background upkeep for the chat-memory collections: expire turns past their
+# TTL, fold old turns of each session into summary entries, and cap how many
+# entries a session may keep. Keeps memory queries and disk use bounded.
+#
+# Every gunicorn worker starts the thread, but only the one holding an
+# exclusive lock on CHROMA_PATH/memory_compaction.lock runs passes. It keeps
+# the lock for its lifetime; when it exits the OS releases the lock and the
+# next worker to wake up takes over.
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; every process then compacts
+    fcntl = None
+
+from . import llmServices
+from . import metrics
+
+_thread = None
+_last_run = {}
+_last_run_lock = threading.Lock()
+
+_interval = 600
+_ttl = 30 * 24 * 3600
+_compact_after = 24 * 3600
+_min_turns = 10
+_max_per_session = 200
+_turns_per_summary = 20
+
+
+def init_compaction(app):
+    """Called from create_app() to start the periodic compaction thread."""
+    global _thread, _interval, _ttl, _compact_after, _min_turns, _max_per_session, _turns_per_summary
+
+    _interval = app.config.get("MEMORY_COMPACT_INTERVAL_S", _interval)
+    _ttl = app.config.get("MEMORY_TTL_S", _ttl)
+    _compact_after = app.config.get("MEMORY_COMPACT_AFTER_S", _compact_after)
+    _min_turns = app.config.get("MEMORY_COMPACT_MIN_TURNS", _min_turns)
+    _max_per_session = app.config.get("MEMORY_MAX_PER_SESSION", _max_per_session)
+    _turns_per_summary = app.config.get("MEMORY_TURNS_PER_SUMMARY", _turns_per_summary)
+
+    if _interval > 0 and _thread is None:
+        _thread = threading.Thread(target=_loop, name="memory-compaction", daemon=True)
+        _thread.start()
+
+
+def compaction_stats():
+    with _last_run_lock:
+        return dict(_last_run)
+
+
+def _loop():
+    lock_file = None
+    while True:
+        time.sleep(_interval)
+        if lock_file is None:
+            lock_file = _take_compaction_lock()
+            if lock_file is None:
+                continue  # another worker compacts
+        try:
+            run_compaction()
+        except Exception as e:
+            print(f"❌ Memory compaction failed: {e}")
+
+
+def _take_compaction_lock():
+    """Returns the open lock file if this process now owns compaction, else None."""
+    path = os.path.join(llmServices.CHROMA_PATH, "memory_compaction.lock")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, 'a')
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    print(f"Memory compaction runs in this worker (pid {os.getpid()}).")
+    return lock_file
+
+
+def run_compaction():
+    """One pass over every chat-memory collection. Returns the counts it changed."""
+    start = time.time()
+    stats = {'collections': 0, 'expired': 0, 'summarized_turns': 0, 'summaries': 0, 'capped': 0}
+
+    for collection in _chat_collections():
+        stats['collections'] += 1
+        _compact_collection(collection, start, stats)
+
+    stats['finished_at'] = time.time()
+    stats['duration_s'] = round(stats['finished_at'] - start, 3)
+    with _last_run_lock:
+        _last_run.clear()
+        _last_run.update(stats)
+    print(f"Memory compaction: {stats}")
+    return stats
+
+
+def _chat_collections():
+    client = llmServices.get_chroma_client()
+    names = [getattr(c, 'name', c) for c in client.list_collections()]
+    return [client.get_collection(name) for name in names
+            if name.startswith("chat_") or name == "study_buddy_chat_history"]
+
+
+def _compact_collection(collection, now, stats):
+    entries = collection.get(include=['metadatas'])
+    sessions = {}
+    expired = []
+    for entry_id, meta in zip(entries['ids'], entries['metadatas']):
+        meta = meta or {}
+        ts = meta.get('ts', 0)  # entries from before timestamps count as oldest
+        if ts < now - _ttl:
+            expired.append(entry_id)
+            continue
+        sessions.setdefault(meta.get('doc_id', ""), []).append((ts, entry_id, meta))
+
+    _delete(collection, expired)
+    stats['expired'] += len(expired)
+
+    for doc_id, items in sessions.items():
+        items.sort(key=lambda item: item[0])
+        old_turns = [item for item in items
+                     if item[2].get('kind') != 'summary' and item[0] < now - _compact_after]
+        if len(old_turns) >= _min_turns:
+            merged = set()
+            for start in range(0, len(old_turns), _turns_per_summary):
+                group = old_turns[start:start + _turns_per_summary]
+                items.append(_summarize_group(collection, doc_id, group))
+                merged.update(entry_id for _, entry_id, _ in group)
+                stats['summarized_turns'] += len(group)
+                stats['summaries'] += 1
+            items = sorted((item for item in items if item[1] not in merged), key=lambda item: item[0])
+
+        excess = len(items) - _max_per_session
+        if excess > 0:
+            _delete(collection, [entry_id for _, entry_id, _ in items[:excess]])
+            stats['capped'] += excess
+
+
+def _summarize_group(collection, doc_id, group):
+    ids = [entry_id for _, entry_id, _ in group]
+    texts = collection.get(ids=ids, include=['documents'])['documents']
+    summary = "Summary of earlier conversation:\n" + _summarize(texts)
+    summary_id = f"chat_summary_{ids[0]}"
+    meta = {"page": 0, "doc_id": doc_id, "ts": group[-1][0], "kind": "summary"}
+    collection.add(
+        documents=[summary],
+        embeddings=llmServices.embed_texts([summary]),
+        metadatas=[meta],
+        ids=[summary_id]
+    )
+    _delete(collection, ids)
+    return meta['ts'], summary_id, meta
+
+
+def _summarize(texts):
+    joined = "\n---\n".join(texts)
+    try:
+        with metrics.span('generate', 'summary'):
+            response = llmServices.get_generative_model().generate_content(
+                "Summarize these study-session exchanges as short notes. Keep definitions, "
+                "facts and open questions; drop greetings and repetition.\n\n" + joined
+            )
+        return response.text.strip()
+    except Exception as e:
+        print(f"Summarizing with the model failed, keeping an extract instead: {e}")
+        # First line of each exchange (the question) is the most useful part to keep
+        return "\n".join(text.split("\n", 1)[0][:200] for text in texts)
+
+
+def _delete(collection, ids):
+    for start in range(0, len(ids), 500):
+        collection.delete(ids=ids[start:start + 500])
@@ -0,0 +1,84 @@
+# memoryWriter.py
+# Write-behind buffer: callers enqueue entries and return immediately; a
+# background thread hands them to ``write_batch`` in batches.
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    def __init__(self, write_batch, batch_size=32, flush_interval=1.0, max_pending=10000):
+        self._write_batch = write_batch
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._idle = threading.Condition()
+        self._in_flight = 0
+        self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, entry):
+        """Queues ``entry``; returns False (and drops it) if the buffer stays full for a second."""
+        with self._idle:
+            self._in_flight += 1
+        try:
+            self._queue.put(entry, timeout=1.0)
+            return True
+        except queue.Full:
+            self._done(1)
+            print("❌ Memory write buffer is full, dropping entry.")
+            return False
+
+    def flush(self, timeout=10.0):
+        """Blocks until everything queued so far has been written (or ``timeout`` passes)."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """Writes out what is pending and stops the thread. Registered with atexit."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+            deadline = None
+            while len(batch) < self._batch_size:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+                if deadline is None:
+                    # Wait a little for company so turns are written together
+                    deadline = time.monotonic() + self._flush_interval
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    print(f"❌ Error writing {len(batch)} memory entries: {e}")
+                self._done(len(batch))
+            if stop:
+                return
+
+    def _done(self, n):
+        with self._idle:
+            self._in_flight -= n
+            if not self._in_flight:
+                self._idle.notify_all()
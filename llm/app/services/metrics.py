@@ -0,0 +1,281 @@
+# metrics.py
+# In-process latency histograms, rendered in the Prometheus text format on
+# /metrics, plus a per-request trace id that prefixes log lines. An
+# observation is one perf_counter() pair and a short locked update, so it
+# stays on in production.
+#
+# gunicorn workers share one listen socket, so a scrape reaches an arbitrary
+# worker. With METRICS_MULTIPROC_DIR set, every worker writes its counts to
+# <dir>/<pid>.json each METRICS_FLUSH_INTERVAL_S and /metrics sums all the
+# files. Files of exited workers are kept, so counters never go backwards
+# when a worker is replaced. Without it, counts are those of the worker that
+# answered, which is only meaningful with a single worker.
+import atexit
+import bisect
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+_DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+
+enabled = True
+_slow_span_s = None
+_trace_header = 'X-Request-Id'
+_multiproc_dir = None
+_flush_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=_DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._series.items()}
+
+    @staticmethod
+    def combine(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def render(self, snapshot):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            labels = _format_labels(self.labelnames, key)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le=bound)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le="+Inf")} {count}')
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(a, b):
+        return a + b
+
+    def render(self, snapshot):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines)
+
+
+def _format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+STAGE_SECONDS = Histogram("study_buddy_stage_seconds", "Time spent in one pipeline stage.", ("stage", "op"))
+HTTP_SECONDS = Histogram("study_buddy_http_request_seconds", "HTTP request latency.",
+                         ("method", "endpoint", "status"))
+EMBEDDED_TEXTS = Counter("study_buddy_embedded_texts_total", "Texts sent to the embedding model.")
+
+
+def render():
+    """Every metric in the Prometheus text format, summed over all workers when METRICS_MULTIPROC_DIR is set."""
+    if _multiproc_dir is None:
+        snapshots = [metric.snapshot() for metric in _registry]
+    else:
+        _flush()
+        snapshots = _read_all()
+    return "\n".join(metric.render(snapshot) for metric, snapshot in zip(_registry, snapshots)) + "\n"
+
+
+def _flush():
+    # This process's counts -> <dir>/<pid>.json, replaced atomically so readers never see half a file
+    state = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in _registry}
+    path = os.path.join(_multiproc_dir, f"{os.getpid()}.json")
+    with _flush_lock:
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def _read_all():
+    snapshots = [{} for _ in _registry]
+    for path in glob.glob(os.path.join(_multiproc_dir, "*.json")):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, snapshot in zip(_registry, snapshots):
+            for key, value in state.get(metric.name, ()):
+                key = tuple(key)
+                snapshot[key] = metric.combine(snapshot[key], value) if key in snapshot else value
+    return snapshots
+
+
+def _flush_periodically(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            _flush()
+        except OSError as e:
+            log(f"Could not write metrics to {_multiproc_dir}: {e}")
+
+
+# ---------------------------------------------------------------- spans
+
+def observe(stage, seconds, op=""):
+    if not enabled:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage, op=op)
+    if _slow_span_s is not None and seconds >= _slow_span_s:
+        log(f"slow {stage}{'/' + op if op else ''}: {seconds * 1000:.1f} ms")
+
+
+@contextmanager
+def span(stage, op=""):
+    """Times the ``with`` block into study_buddy_stage_seconds{stage, op}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, op)
+
+
+def timed_iter(iterable, stage, op=""):
+    """Yields from ``iterable``, observing the time each item took to produce."""
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            observe(stage, time.perf_counter() - start, op)
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            close()
+
+
+class _TimedProxy:
+    def __init__(self, target, stage, methods):
+        self._target = target
+        self._stage = stage
+        self._methods = methods
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._methods:
+            return attr
+
+        def timed(*args, **kwargs):
+            with span(self._stage, name):
+                return attr(*args, **kwargs)
+        return timed
+
+
+def timed_proxy(target, stage, methods):
+    """Wraps ``target`` so each call to one of ``methods`` is a span with ``op`` = method name."""
+    return _TimedProxy(target, stage, frozenset(methods))
+
+
+# ---------------------------------------------------------------- trace ids
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def set_trace_id(trace_id):
+    _trace_id.set(trace_id)
+
+
+def bind(fn):
+    """Returns ``fn`` running in a copy of the caller's context, so pool threads keep its trace id."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def log(message):
+    trace_id = _trace_id.get()
+    print(f"[{trace_id}] {message}" if trace_id else message)
+
+
+def init_metrics(app):
+    """Called from create_app(): reads METRICS_* settings and times every request."""
+    global enabled, _slow_span_s, _trace_header, _multiproc_dir
+    from flask import g, request
+
+    enabled = app.config.get("METRICS_ENABLED", True)
+    slow_ms = app.config.get("SLOW_SPAN_LOG_MS", 0)
+    _slow_span_s = slow_ms / 1000.0 if slow_ms else None
+    _trace_header = app.config.get("TRACE_HEADER", _trace_header)
+
+    if enabled and app.config.get("METRICS_MULTIPROC_DIR"):
+        _multiproc_dir = app.config["METRICS_MULTIPROC_DIR"]
+        os.makedirs(_multiproc_dir, exist_ok=True)
+        threading.Thread(target=_flush_periodically, args=(app.config.get("METRICS_FLUSH_INTERVAL_S", 1.0),),
+                         name="metrics-flush", daemon=True).start()
+        atexit.register(_flush)
+
+    @app.before_request
+    def _start_request():
+        # Reuse the caller's id when a proxy already assigned one
+        incoming = request.headers.get(_trace_header, "")
+        set_trace_id(incoming[:64] if incoming else uuid.uuid4().hex[:16])
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_request(response):
+        elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        if enabled:
+            HTTP_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+        response.headers['X-Trace-Id'] = current_trace_id() or ""
+        if endpoint != '/metrics':
+            log(f"{request.method} {request.path} {response.status_code} {elapsed * 1000:.1f} ms")
+        return response
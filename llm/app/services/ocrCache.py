@@ -0,0 +1,74 @@
+# ocrCache.py
+# Persistent OCR results keyed by the SHA-256 of the image bytes, so repeated
+# logos/headers and re-uploaded handouts never go through tesseract twice.
+# The file is shared by every gunicorn worker, so the size that drives
+# eviction is always read back from the table, never tracked per process.
+import os
+import sqlite3
+import threading
+import time
+
+
+class OcrCache:
+    """SQLite-backed text cache, capped at ``max_bytes`` with LRU eviction."""
+
+    def __init__(self, path, max_bytes):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr ("
+            " digest TEXT PRIMARY KEY, text TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr (last_used)")
+        self._conn.commit()
+
+    def get(self, digest):
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE ocr SET last_used = ? WHERE digest = ?", (time.time(), digest))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, digest, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr (digest, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (digest, text, size, time.time())
+            )
+            # The INSERT opened a write transaction, so no other worker can
+            # change the table between this sum and the commit
+            total = self._total()
+            if total > self.max_bytes:
+                self._evict(total)
+            self._conn.commit()
+
+    def _total(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr").fetchone()[0]
+
+    def _evict(self, total):
+        # Drop least recently used entries until we are back under 90% of the cap,
+        # so a full cache doesn't evict on every single insert. Caller holds _lock.
+        target = self.max_bytes * 0.9
+        doomed = []
+        for digest, size in self._conn.execute("SELECT digest, size FROM ocr ORDER BY last_used"):
+            if total <= target:
+                break
+            doomed.append((digest,))
+            total -= size
+        self._conn.executemany("DELETE FROM ocr WHERE digest = ?", doomed)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes': self._total(), 'max_bytes': self.max_bytes}
@@ -0,0 +1,136 @@
+# ocrServices.py
+# OCR stage for PDF ingestion. Page images are OCRed on a process pool so a
+# scanned document uses every core instead of one tesseract call at a time.
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .ocrCache import OcrCache
+from . import metrics
+
+_pool = None
+_cache = None
+_pool_lock = threading.Lock()
+
+_workers = os.cpu_count() or 1
+_min_text_chars = 200
+_window = 8
+
+
+def configure_ocr(config):
+    """Reads OCR_* settings from the Flask config. Called from init_rag()."""
+    global _workers, _min_text_chars, _window, _cache
+    _workers = config.get("OCR_WORKERS") or os.cpu_count() or 1
+    _min_text_chars = config.get("OCR_MIN_TEXT_CHARS", 200)
+    # Pages in flight at once; bounds the image bytes held in memory.
+    _window = config.get("OCR_WINDOW_PAGES") or _workers * 2
+
+    max_bytes = config.get("OCR_CACHE_MAX_BYTES", 0)
+    if max_bytes > 0:
+        _cache = OcrCache(os.path.join(config.get("OCR_CACHE_DIR", "./ocr_cache"), "ocr.sqlite3"), max_bytes)
+
+
+def ocr_cache_stats():
+    return _cache.stats() if _cache else None
+
+
+def _init_worker():
+    # Each pool process runs its own tesseract; keep it single-threaded so
+    # N workers don't oversubscribe the cores.
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the ingest and job threads may hold locks at fork time
+            _pool = ProcessPoolExecutor(max_workers=_workers, initializer=_init_worker,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _ocr_image_bytes(image_bytes):
+    """Runs in a pool process. Returns ``(text, seconds)``; text is None for images tesseract can't read."""
+    start = time.perf_counter()
+    try:
+        import pytesseract
+        from PIL import Image
+        image = Image.open(io.BytesIO(image_bytes))
+        text = pytesseract.image_to_string(image)
+    except Exception:
+        text = None
+    return text, time.perf_counter() - start
+
+
+def ocr_pdf_pages(doc):
+    """Yields ``(page_num, page_text, ocr_text)`` for every page of ``doc`` in order.
+
+    Pages whose text layer already has OCR_MIN_TEXT_CHARS characters are not
+    OCRed. Up to OCR_WINDOW_PAGES pages are OCRed concurrently. An image that
+    repeats within the document, or was OCRed for an earlier upload, is served
+    from the OCR cache instead of being sent to tesseract again.
+    """
+    seen = {}         # digest -> OCR text, or the Future computing it
+    xref_digest = {}  # xref -> digest, so repeated xrefs skip extract_image too
+    pending = deque()
+    try:
+        for page_num, page in enumerate(doc):
+            page_text = page.get_text()
+            items = []
+            if len(page_text.strip()) < _min_text_chars:
+                for img in page.get_images(full=True):
+                    xref = img[0]
+                    if xref in xref_digest:
+                        digest = xref_digest[xref]
+                        items.append((digest, seen[digest]))
+                        continue
+                    try:
+                        image_bytes = doc.extract_image(xref)["image"]
+                    except Exception:
+                        continue
+                    digest = xref_digest[xref] = hashlib.sha256(image_bytes).hexdigest()
+                    items.append((digest, _lookup(digest, image_bytes, seen)))
+            pending.append((page_num, page_text, items))
+
+            while len(pending) > _window:
+                yield _collect(pending.popleft(), seen)
+
+        while pending:
+            yield _collect(pending.popleft(), seen)
+    finally:
+        for _, _, items in pending:
+            for _, item in items:
+                if isinstance(item, Future):
+                    item.cancel()
+
+
+def _lookup(digest, image_bytes, seen):
+    if digest not in seen:
+        text = _cache.get(digest) if _cache else None
+        seen[digest] = text if text is not None else _get_pool().submit(_ocr_image_bytes, image_bytes)
+    return seen[digest]
+
+
+def _collect(entry, seen):
+    page_num, page_text, items = entry
+    ocr_text = ""
+    for digest, item in items:
+        if isinstance(item, Future):
+            text, seconds = item.result()
+            # First page to resolve this image stores it for everyone after
+            if seen.get(digest) is item:
+                # Timed in the pool process, reported here where /metrics lives
+                metrics.observe('ocr', seconds)
+                seen[digest] = text if text is not None else ""
+                if text is not None and _cache:
+                    _cache.put(digest, text)
+            item = text
+        if item is not None:
+            ocr_text += item + "\n"
+    return page_num, page_text, ocr_text
@@ -0,0 +1,120 @@
+# promptPacker.py
+# Builds the generation prompt under a token budget: recent turns verbatim,
+# then document chunks, then long-term memory, then a digest of older turns.
+# Near-duplicate snippets are dropped so the budget isn't spent twice.
+from .textChunker import approx_token_count
+
+_DUPLICATE_OVERLAP = 0.8   # share of a snippet's words already present elsewhere
+_SUMMARY_TOKENS = 30       # per older turn kept as a digest
+
+
+def pack_prompt(question, doc_hits, memory_snippets, chat_history, budget, recent_turns,
+                count_tokens=approx_token_count):
+    """Returns ``(prompt, sources, breakdown)``.
+
+    ``doc_hits`` is a ranked list of ``(document, metadata)``; only chunks that
+    fit are kept, and ``sources`` lists their metadata. ``breakdown`` reports
+    the tokens spent on each section plus what was dropped or summarized.
+    """
+    breakdown = {'question': count_tokens(question), 'history': 0, 'document': 0, 'memory': 0,
+                 'budget': budget, 'dropped_chunks': 0, 'dropped_memory': 0,
+                 'summarized_turns': 0, 'dropped_turns': 0}
+    remaining = budget - breakdown['question']
+    seen = []  # word sets of everything already in the prompt
+
+    # 1. The latest turns, verbatim, newest first until the budget runs out
+    turns = [f"{msg['role']}: {msg['parts']}" for msg in chat_history]
+    split = max(0, len(turns) - recent_turns)
+    older, recent = turns[:split], turns[split:]
+    kept_recent = []
+    for turn in reversed(recent):
+        tokens = count_tokens(turn)
+        if tokens > remaining:
+            break
+        kept_recent.insert(0, turn)
+        seen.append(_words(turn))
+        remaining -= tokens
+        breakdown['history'] += tokens
+    # Recent turns that didn't fit verbatim compete for a digest like older ones
+    older += recent[:len(recent) - len(kept_recent)]
+
+    # 2. Document chunks in retrieval order
+    context_parts, sources = [], []
+    for doc, meta in doc_hits:
+        text = f"Context from Page {meta['page']}:\n{doc}\n---\n"
+        tokens = count_tokens(text)
+        if tokens > remaining or _is_duplicate(doc, seen):
+            breakdown['dropped_chunks'] += 1
+            continue
+        context_parts.append(text)
+        sources.append(meta)
+        seen.append(_words(doc))
+        remaining -= tokens
+        breakdown['document'] += tokens
+
+    # 3. Long-term memory that adds something new
+    memory_parts = []
+    for snippet in memory_snippets:
+        tokens = count_tokens(snippet)
+        if tokens > remaining or _is_duplicate(snippet, seen):
+            breakdown['dropped_memory'] += 1
+            continue
+        memory_parts.append(snippet)
+        seen.append(_words(snippet))
+        remaining -= tokens
+        breakdown['memory'] += tokens
+
+    # 4. Older turns shrink to a short digest each, newest first, while room is left
+    digests = []
+    for turn in reversed(older):
+        digest = _truncate(turn, _SUMMARY_TOKENS)
+        tokens = count_tokens(digest)
+        if tokens > remaining:
+            break
+        digests.insert(0, digest)
+        remaining -= tokens
+        breakdown['history'] += tokens
+    breakdown['summarized_turns'] = len(digests)
+    breakdown['dropped_turns'] = len(older) - len(digests)
+
+    history_lines = []
+    if digests:
+        history_lines.append("(earlier turns, abridged)")
+        history_lines.extend(digests)
+        history_lines.append("(latest turns)")
+    history_lines.extend(kept_recent)
+
+    document_context = "".join(context_parts) or "No relevant context found."
+    long_term = "\n---\n".join(memory_parts)
+    formatted_history = "\n".join(history_lines)
+
+    prompt = f"""
+    DOCUMENT:
+    {document_context}
+    LONG TERM:
+    {long_term}
+    RECENT CHAT:
+    {formatted_history}
+    LATEST QUESTION: {question}
+    """
+    breakdown['total'] = breakdown['question'] + breakdown['history'] + breakdown['document'] + breakdown['memory']
+    return prompt, sources, breakdown
+
+
+def _words(text):
+    return set(text.lower().split())
+
+
+def _is_duplicate(text, seen):
+    words = _words(text)
+    if not words:
+        return True
+    return any(len(words & other) >= _DUPLICATE_OVERLAP * len(words) for other in seen)
+
+
+def _truncate(text, max_tokens):
+    words = text.split()
+    # approx_token_count is at least one token per word, so this never overshoots by much
+    if len(words) <= max_tokens:
+        return text
+    return " ".join(words[:max_tokens]) + " ..."
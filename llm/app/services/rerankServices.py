@@ -0,0 +1,64 @@
+# rerankServices.py
+# Optional cross-encoder rerank stage: scores a wide candidate set against the
+# question and keeps only chunks above a relevance cutoff, up to a budget.
+import threading
+import time
+
+_model = None
+_model_lock = threading.Lock()
+_load_failed = False
+
+enabled = False
+candidates = 20
+_model_name = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+_min_score = 0.0
+_max_chunks = 5
+_batch_size = 16
+
+
+def configure_reranker(config):
+    """Reads RERANK_* settings from the Flask config. Called from init_rag()."""
+    global enabled, candidates, _model_name, _min_score, _max_chunks, _batch_size
+    enabled = config.get("RERANK_ENABLED", False)
+    candidates = config.get("RERANK_CANDIDATES", 20)
+    _model_name = config.get("RERANK_MODEL", _model_name)
+    _min_score = config.get("RERANK_MIN_SCORE", 0.0)
+    _max_chunks = config.get("RERANK_MAX_CHUNKS", 5)
+    _batch_size = config.get("RERANK_BATCH_SIZE", 16)
+
+
+def _get_model():
+    global _model, _load_failed
+    with _model_lock:
+        if _model is None and not _load_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                print(f"Loading reranker {_model_name}...")
+                _model = CrossEncoder(_model_name)
+            except Exception as e:
+                print(f"❌ Could not load reranker, continuing without it: {e}")
+                _load_failed = True
+        return _model
+
+
+def rerank(query_text, hits, fallback_k):
+    """Reorders ``hits`` (``(id, document, metadata)`` tuples) by cross-encoder score.
+
+    Keeps at most RERANK_MAX_CHUNKS hits scoring at least RERANK_MIN_SCORE,
+    each with its score added to the metadata as ``relevance``. If the model
+    is unavailable the first ``fallback_k`` hits are returned unchanged.
+    Returns ``(hits, elapsed_ms)``.
+    """
+    start = time.perf_counter()
+    model = _get_model()
+    if model is None or not hits:
+        return hits[:fallback_k], 0.0
+
+    scores = model.predict([(query_text, doc) for _, doc, _ in hits], batch_size=_batch_size)
+    ranked = sorted(zip(hits, scores), key=lambda pair: pair[1], reverse=True)
+    kept = [
+        (chunk_id, doc, {**meta, 'relevance': round(float(score), 3)})
+        for (chunk_id, doc, meta), score in ranked[:_max_chunks]
+        if score >= _min_score
+    ]
+    return kept, round((time.perf_counter() - start) * 1000, 1)
@@ -0,0 +1,78 @@
+# textChunker.py
+# Streams (page_number, text) segments into chunks that fit the embedding
+# model's token window, with a sliding overlap between consecutive chunks.
+import math
+import re
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+def approx_token_count(text):
+    """Cheap token estimate (words + punctuation) for when no tokenizer is at hand."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def chunk_stream(segments, max_tokens=200, overlap_tokens=40, count_tokens=approx_token_count):
+    """Yields ``{'page_number', 'page_end', 'content'}`` chunks of at most ``max_tokens``.
+
+    ``segments`` is any iterable of ``(page_number, text)``; it is consumed lazily,
+    so chunks come out while later pages are still being parsed. Text is split on
+    sentence and paragraph boundaries, and the last ``overlap_tokens`` worth of
+    sentences are repeated at the start of the next chunk.
+    """
+    buffer = []  # (page_number, text, tokens)
+    buffer_tokens = 0
+
+    for page_number, text in segments:
+        for piece, tokens in _pieces(text, max_tokens, count_tokens):
+            if buffer and buffer_tokens + tokens > max_tokens:
+                yield _make_chunk(buffer)
+                buffer = _overlap_tail(buffer, overlap_tokens)
+                buffer_tokens = sum(t for _, _, t in buffer)
+                # Drop overlap that would not leave room for the new piece
+                while buffer and buffer_tokens + tokens > max_tokens:
+                    buffer_tokens -= buffer.pop(0)[2]
+            buffer.append((page_number, piece, tokens))
+            buffer_tokens += tokens
+
+    if buffer:
+        yield _make_chunk(buffer)
+
+
+def _pieces(text, max_tokens, count_tokens):
+    for sentence in _SENTENCE_RE.split(text):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            yield sentence, tokens
+            continue
+        # A single run-on "sentence" (tables, OCR noise): cut it into even word windows
+        words = sentence.split()
+        parts = math.ceil(tokens / max_tokens) + 1
+        step = max(1, math.ceil(len(words) / parts))
+        for start in range(0, len(words), step):
+            part = " ".join(words[start:start + step])
+            yield part, count_tokens(part)
+
+
+def _overlap_tail(buffer, overlap_tokens):
+    tail = []
+    total = 0
+    for entry in reversed(buffer):
+        if total + entry[2] > overlap_tokens:
+            break
+        tail.insert(0, entry)
+        total += entry[2]
+    # Never carry the whole previous chunk over, or it would repeat forever
+    return tail if len(tail) < len(buffer) else tail[1:]
+
+
+def _make_chunk(buffer):
+    return {
+        'page_number': buffer[0][0],
+        'page_end': buffer[-1][0],
+        'content': " ".join(text for _, text, _ in buffer),
+    }
@@ -0,0 +1,114 @@
+# uploadSpool.py
+# Holds an uploaded file until an ingestion worker gets to it. Small uploads
+# stay in memory; larger ones spill to a temp file that is deleted as soon as
+# it is closed, so no error path leaves it behind in uploads/.
+import io
+import os
+import tempfile
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+_CHUNK_BYTES = 1 << 20
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when spooled data goes past the caller's ``max_bytes``."""
+
+
+def spool_upload(stream, max_memory_bytes, directory=None, max_bytes=None):
+    """Copies ``stream`` in 1 MiB pieces and returns a readable binary file positioned at 0.
+
+    Up to ``max_memory_bytes`` the result is a BytesIO; beyond that it is a
+    NamedTemporaryFile in ``directory`` (its ``name`` is a real path, which
+    PDF parsing uses to avoid loading the whole file). Closing it frees or
+    deletes the data. Raises UploadTooLargeError once more than ``max_bytes``
+    have been read.
+    """
+    target = io.BytesIO()
+    total = 0
+    try:
+        while True:
+            chunk = stream.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            total += len(chunk)
+            if max_bytes is not None and total > max_bytes:
+                raise UploadTooLargeError(f"More than {max_bytes} bytes")
+            if isinstance(target, io.BytesIO) and target.tell() + len(chunk) > max_memory_bytes:
+                spilled = tempfile.NamedTemporaryFile(dir=directory, prefix="upload_", delete=True)
+                spilled.write(target.getbuffer())
+                target.close()
+                target = spilled
+            target.write(chunk)
+        target.seek(0)
+        return target
+    except BaseException:
+        target.close()
+        raise
+
+
+def source_path(source):
+    """The filesystem path behind ``source`` (a path or an open file), or None if it only lives in memory."""
+    if isinstance(source, str):
+        return source
+    name = getattr(source, 'name', None)
+    return name if isinstance(name, str) else None
+
+
+class ArchiveMember:
+    """One file inside an open ZIP archive. Nothing is decompressed until open()."""
+
+    def __init__(self, zf, info, filename):
+        self._zf = zf
+        self._info = info
+        self.filename = filename
+        self.size = info.file_size
+
+    def open(self, max_memory_bytes, directory=None):
+        """Spools the member like spool_upload() and returns the file; the caller closes it."""
+        # zipfile never yields more than the declared size (the CRC check
+        # fails instead), so ``size`` is a hard bound, not a hint
+        with self._zf.open(self._info) as member:
+            return spool_upload(member, max_memory_bytes, directory, max_bytes=self.size)
+
+
+def expand_archive(archive, extensions, max_files, max_bytes):
+    """Lists the members of the ZIP file ``archive`` worth ingesting; returns ``(members, skipped)``.
+
+    ``members`` are ArchiveMember objects, named by the member's path
+    flattened by secure_filename (``week1/notes.pdf`` becomes
+    ``week1_notes.pdf``); they are decompressed one at a time as they are
+    opened, so the archive never sits expanded in memory. Directories, macOS
+    resource forks, hidden files, encrypted members and extensions not in
+    ``extensions`` are left out and listed in ``skipped`` as
+    ``{'filename', 'reason'}``. Raises ValueError for an unreadable archive or
+    one over ``max_files`` members or ``max_bytes`` decompressed. ``archive``
+    must stay open while the members are used.
+    """
+    members, skipped = [], []
+    total = 0
+    try:
+        zf = zipfile.ZipFile(archive)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError) as e:
+        raise ValueError(f"Could not read archive: {e}")
+    for info in zf.infolist():
+        parts = info.filename.replace('\\', '/').split('/')
+        if info.is_dir():
+            continue
+        if parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts if part):
+            continue
+        filename = secure_filename('_'.join(part for part in parts if part))
+        if info.flag_bits & 0x1:
+            skipped.append({'filename': info.filename, 'reason': 'encrypted'})
+            continue
+        if not filename or os.path.splitext(filename)[1].lower() not in extensions:
+            skipped.append({'filename': info.filename, 'reason': 'unsupported file type'})
+            continue
+        if len(members) >= max_files:
+            raise ValueError(f"Archive holds more than {max_files} supported files")
+        total += info.file_size
+        if total > max_bytes:
+            raise ValueError(f"Archive expands to more than {max_bytes} bytes")
+        members.append(ArchiveMember(zf, info, filename))
+    return members, skipped
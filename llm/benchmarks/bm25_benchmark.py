@@ -0,0 +1,131 @@
+# bm25_benchmark.py
+# Measures Bm25Index.search latency on a synthetic corpus whose term
+# frequencies follow a Zipf distribution, as real course material does, and
+# checks that every result matches exhaustive BM25 scoring.
+#
+#   python benchmarks/bm25_benchmark.py --chunks 30000 --queries 500 --terms 3
+#
+# Query terms are drawn from the same Zipf distribution, so most queries mix
+# rare words with very common ones (the expensive case for posting walks).
+# The first search of each term after a change to the index builds that
+# term's score arrays; that first pass is reported separately as cold_ms,
+# and search_ms is a second pass over the same queries.
+# Exits non-zero if any result differs from exhaustive scoring.
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.bm25Index import Bm25Index, tokenize  # noqa: E402
+
+
+def zipf_sampler(vocabulary, exponent, rng):
+    cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(vocabulary)))
+    words = [f"w{rank}" for rank in range(vocabulary)]
+    return lambda count: rng.choices(words, cum_weights=cumulative, k=count)
+
+
+def exhaustive(index, query_text, k, doc_id=None):
+    # Reference: score every posting of every query term
+    n = len(index._doc_len)
+    avg_len = index._total_len / n or 1.0
+    scores = {}
+    for term in set(tokenize(query_text)):
+        postings = index._postings.get(term)
+        if not postings:
+            continue
+        idf = index._idf(term, n)
+        for chunk_id, tf in postings.items():
+            if doc_id and index._chunk_doc[chunk_id] != doc_id:
+                continue
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + index._term_score(idf, tf, chunk_id, avg_len)
+    return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def same_ranking(got, expected):
+    # Ties may come back in either order; compare the scores rank by rank
+    return len(got) == len(expected) and all(abs(a[1] - b[1]) < 1e-9 for a, b in zip(got, expected))
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'p50': round(pick(0.50), 3), 'p95': round(pick(0.95), 3), 'p99': round(pick(0.99), 3),
+            'mean': round(statistics.mean(ordered), 3), 'max': round(ordered[-1], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 search latency and exactness on a Zipf corpus.")
+    parser.add_argument("--chunks", type=int, default=30000)
+    parser.add_argument("--chunk-terms", type=int, default=120, help="terms per chunk")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--exponent", type=float, default=1.1, help="Zipf exponent")
+    parser.add_argument("--docs", type=int, default=100, help="documents the chunks are spread over")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--terms", type=int, default=3, help="terms per query")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sample = zipf_sampler(args.vocabulary, args.exponent, rng)
+
+    start = time.perf_counter()
+    index = Bm25Index(path=os.devnull)
+    chunk_ids = [f"c{i}" for i in range(args.chunks)]
+    texts = [" ".join(sample(max(1, int(rng.gauss(args.chunk_terms, args.chunk_terms / 4)))))
+             for _ in range(args.chunks)]
+    index.add(chunk_ids, texts, [f"d{i % args.docs}" for i in range(args.chunks)])
+    build_s = time.perf_counter() - start
+
+    queries = [" ".join(sample(args.terms)) for _ in range(args.queries)]
+    # First pass: each term's arrays are built on first use. Second pass: steady state
+    cold, warm, mismatches = [], [], 0
+    for samples in (cold, warm):
+        for query in queries:
+            begin = time.perf_counter()
+            got = index.search(query, args.k)
+            samples.append((time.perf_counter() - begin) * 1000)
+            if not same_ranking(got, exhaustive(index, query, args.k)):
+                mismatches += 1
+
+    filtered = []
+    for query in queries[:100]:
+        doc_id = f"d{rng.randrange(args.docs)}"
+        begin = time.perf_counter()
+        got = index.search(query, args.k, doc_id)
+        filtered.append((time.perf_counter() - begin) * 1000)
+        if not same_ranking(got, exhaustive(index, query, args.k, doc_id)):
+            mismatches += 1
+
+    exhaustive_ms = []
+    for query in queries[:100]:
+        begin = time.perf_counter()
+        exhaustive(index, query, args.k)
+        exhaustive_ms.append((time.perf_counter() - begin) * 1000)
+
+    report = {
+        'chunks': args.chunks,
+        'terms_per_query': args.terms,
+        'k': args.k,
+        'queries': args.queries,
+        'build_s': round(build_s, 2),
+        'search_ms': percentiles(warm),
+        'cold_ms': percentiles(cold),
+        'doc_filtered_ms': percentiles(filtered),
+        'exhaustive_ms': percentiles(exhaustive_ms),
+        'mismatches': mismatches,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
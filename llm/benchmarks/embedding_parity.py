@@ -0,0 +1,114 @@
+# embedding_parity.py
+# Checks that a faster embedding backend still retrieves what the float
+# SentenceTransformer model retrieves, and measures chunks/s for both.
+#
+#   python benchmarks/embedding_parity.py --corpus notes.txt --backend onnx --threads 4
+#
+# The corpus is split into paragraph-sized chunks; each chunk's first
+# sentence is used as a query. Recall@k is the share of the reference
+# model's top-k neighbours that the candidate backend also returns. Exits
+# non-zero when recall or mean cosine falls below the tolerance.
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.embeddingBackends import load_embedding_backend, DEFAULT_MODEL, DEFAULT_ONNX_FILE  # noqa: E402
+
+_SAMPLE = [
+    "Entropy is a measure of the number of microscopic configurations of a system.",
+    "The second law of thermodynamics states that the entropy of an isolated system never decreases.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "Mitochondria produce most of the cell's supply of adenosine triphosphate.",
+    "A binary search tree keeps keys in sorted order so lookups take logarithmic time.",
+    "Dijkstra's algorithm finds shortest paths from a source in graphs with non-negative weights.",
+    "The French Revolution began in 1789 with the storming of the Bastille.",
+    "Supply and demand determine the market price of a good in a competitive market.",
+    "Newton's second law relates force, mass and acceleration: F equals m times a.",
+    "An enzyme lowers the activation energy of a chemical reaction without being consumed.",
+    "Inflation is the rate at which the general level of prices rises over time.",
+    "A hash table maps keys to buckets using a hash function for constant-time lookups.",
+]
+
+
+def load_corpus(path, limit):
+    if not path:
+        return list(_SAMPLE)
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    chunks = [p.strip() for p in re.split(r"\n\s*\n", text) if len(p.split()) >= 5]
+    return chunks[:limit]
+
+
+def first_sentence(text):
+    return re.split(r"(?<=[.!?])\s+", text, maxsplit=1)[0]
+
+
+def timed_encode(model, texts, batch_size):
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+    start = time.perf_counter()
+    vectors = np.asarray(model.encode(texts, batch_size=batch_size), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    return vectors, len(texts) / elapsed if elapsed else float('inf')
+
+
+def top_k(query_vectors, corpus_vectors, k):
+    scores = query_vectors @ corpus_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against the float model.")
+    parser.add_argument("--corpus", help="text file; paragraphs become chunks (default: built-in sample)")
+    parser.add_argument("--limit", type=int, default=2000, help="max chunks to use")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--backend", default="onnx", help="candidate backend to compare")
+    parser.add_argument("--onnx-file", default=DEFAULT_ONNX_FILE)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+
+    chunks = load_corpus(args.corpus, args.limit)
+    queries = [first_sentence(c) for c in chunks]
+    k = min(args.k, len(chunks))
+
+    reference = load_embedding_backend("sentence-transformers", args.model, threads=args.threads)
+    candidate = load_embedding_backend(args.backend, args.model, threads=args.threads, onnx_file=args.onnx_file)
+
+    ref_chunks, ref_rate = timed_encode(reference, chunks, args.batch_size)
+    cand_chunks, cand_rate = timed_encode(candidate, chunks, args.batch_size)
+    ref_queries = np.asarray(reference.encode(queries, batch_size=args.batch_size), dtype=np.float32)
+    cand_queries = np.asarray(candidate.encode(queries, batch_size=args.batch_size), dtype=np.float32)
+
+    cosines = np.sum(ref_chunks * cand_chunks, axis=1)
+    ref_hits = top_k(ref_queries, ref_chunks, k)
+    cand_hits = top_k(cand_queries, cand_chunks, k)
+    recall = float(np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_hits, cand_hits)]))
+
+    report = {
+        'chunks': len(chunks),
+        'backend': args.backend,
+        'threads': args.threads or 'default',
+        f'recall_at_{k}': round(recall, 4),
+        'cosine_mean': round(float(cosines.mean()), 4),
+        'cosine_min': round(float(cosines.min()), 4),
+        'reference_chunks_per_s': round(ref_rate, 1),
+        'candidate_chunks_per_s': round(cand_rate, 1),
+        'speedup': round(cand_rate / ref_rate, 2) if ref_rate else None,
+    }
+    report['ok'] = recall >= args.min_recall and report['cosine_mean'] >= args.min_cosine
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == "__main__":
+    main()
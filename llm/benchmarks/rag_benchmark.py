@@ -0,0 +1,407 @@
+# rag_benchmark.py
+# Offline load test for /upload and /ask. Builds a synthetic corpus (PDF with
+# text and image-only pages, DOCX, TXT), replaces the Gemini model with a
+# deterministic stand-in that sleeps for a configurable latency, and drives
+# the app from create_app() with a thread pool. Per-stage p50/p95/p99 and
+# throughput are printed and saved as JSON so runs can be compared.
+#
+#   python benchmarks/rag_benchmark.py --docs 6 --pages 8 --queries 200 --concurrency 8
+#
+# Everything runs in a scratch directory (Chroma store, uploads, OCR cache),
+# so the real ./chroma_db is never touched. The embedding model still has to
+# be available locally (or in the Hugging Face cache). Settings from config.py
+# can be overridden with the usual environment variables.
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LLM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LLM_DIR)
+
+USER_ID = "benchmark"
+
+_TOPICS = {
+    "entropy": "Entropy measures how many microscopic arrangements match a macroscopic state.",
+    "photosynthesis": "Photosynthesis turns light energy, water and carbon dioxide into glucose and oxygen.",
+    "recursion": "Recursion solves a problem by reducing it to smaller instances of the same problem.",
+    "inflation": "Inflation is the general rise of prices that lowers the purchasing power of money.",
+    "mitosis": "Mitosis divides one nucleus into two genetically identical nuclei.",
+    "supply curve": "A supply curve shows how much producers offer at each price.",
+    "binary search": "Binary search halves a sorted range on every comparison.",
+    "osmosis": "Osmosis moves water across a membrane toward the higher solute concentration.",
+    "the French Revolution": "The French Revolution of 1789 ended absolute monarchy in France.",
+    "Ohm's law": "Ohm's law states that current equals voltage divided by resistance.",
+    "natural selection": "Natural selection favours heritable traits that improve survival and reproduction.",
+    "a hash table": "A hash table stores values in buckets chosen by a hash of the key.",
+}
+_FILLER = [
+    "This point comes up often in the exam.",
+    "Lecture notes give a worked example of it.",
+    "Students frequently confuse it with a related idea.",
+    "The textbook treats it in the chapter summary.",
+    "A diagram in the slides illustrates the main steps.",
+    "It is easier to remember with a concrete example.",
+]
+_QUESTIONS = [
+    "What is {topic}?",
+    "Explain {topic} in simple terms.",
+    "Give an example of {topic}.",
+    "Why does {topic} matter?",
+    "Summarize what the notes say about {topic}.",
+]
+
+
+# ---------------------------------------------------------------- corpus
+
+def _paragraphs(rng, count):
+    topics = list(_TOPICS)
+    paragraphs = []
+    for _ in range(count):
+        topic = rng.choice(topics)
+        sentences = [_TOPICS[topic]] + rng.sample(_FILLER, 3)
+        rng.shuffle(sentences)
+        paragraphs.append(f"About {topic}: " + " ".join(sentences))
+    return paragraphs
+
+
+def _image_page_png(text):
+    from PIL import Image, ImageDraw
+    # Big enough for tesseract to read the default bitmap font after upscaling
+    image = Image.new("L", (900, 400), 255)
+    draw = ImageDraw.Draw(image)
+    words, line, y = text.split(), "", 20
+    for word in words:
+        if len(line) + len(word) > 60:
+            draw.text((20, y), line, fill=0)
+            line, y = "", y + 18
+        line = f"{line} {word}".strip()
+    draw.text((20, y), line, fill=0)
+    image = image.resize((image.width * 2, image.height * 2))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _write_pdf(path, rng, pages, image_ratio):
+    import fitz
+    doc = fitz.open()
+    image_pages = 0
+    for _ in range(pages):
+        page = doc.new_page()
+        text = "\n\n".join(_paragraphs(rng, 3))
+        if rng.random() < image_ratio:
+            # Scanned page: no text layer at all, so it has to go through OCR
+            page.insert_image(fitz.Rect(36, 36, page.rect.width - 36, 320), stream=_image_page_png(text))
+            image_pages += 1
+        else:
+            page.insert_textbox(fitz.Rect(54, 54, page.rect.width - 54, page.rect.height - 54), text, fontsize=10)
+    doc.save(path)
+    return image_pages
+
+
+def _write_docx(path, rng, pages):
+    import docx
+    document = docx.Document()
+    for paragraph in _paragraphs(rng, pages * 3):
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def _write_txt(path, rng, pages):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(_paragraphs(rng, pages * 3)))
+
+
+def build_corpus(out_dir, docs, pages, image_ratio, seed):
+    """Writes ``docs`` files of each type into ``out_dir``; returns ``(paths, info)``."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths, image_pages = [], 0
+    for i in range(docs):
+        pdf = os.path.join(out_dir, f"lecture_{i:03d}.pdf")
+        image_pages += _write_pdf(pdf, rng, pages, image_ratio)
+        docx_path = os.path.join(out_dir, f"handout_{i:03d}.docx")
+        _write_docx(docx_path, rng, pages)
+        txt = os.path.join(out_dir, f"notes_{i:03d}.txt")
+        _write_txt(txt, rng, pages)
+        paths += [pdf, docx_path, txt]
+    info = {'files': len(paths), 'pdf_pages': docs * pages, 'image_only_pages': image_pages,
+            'bytes': sum(os.path.getsize(p) for p in paths)}
+    return paths, info
+
+
+def build_queries(count, followup_ratio, seed):
+    """``count`` ``(query, history)`` pairs; some carry history so the rewrite stage runs."""
+    rng = random.Random(seed + 1)
+    topics = list(_TOPICS)
+    queries = []
+    for _ in range(count):
+        topic = rng.choice(topics)
+        question = rng.choice(_QUESTIONS).format(topic=topic)
+        if rng.random() < followup_ratio:
+            history = [{'role': 'user', 'parts': question},
+                       {'role': 'model', 'parts': _TOPICS[topic]}]
+            queries.append(("Why does it matter?", history))
+        else:
+            queries.append((question, []))
+    return queries
+
+
+# ---------------------------------------------------------------- LLM stand-in
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Deterministic stand-in for ``genai.GenerativeModel``.
+
+    Sleeps ``latency_ms`` (plus up to ``jitter_ms``, derived from the prompt so
+    runs repeat exactly) and answers from the prompt itself. Rewrite prompts
+    get the question back unchanged. Streaming splits the answer into
+    ``stream_chunks`` pieces spread over the same latency.
+    """
+
+    def __init__(self, latency_ms=300, jitter_ms=0, stream_chunks=8):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stream_chunks = max(1, stream_chunks)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        digest = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        delay = (self.latency_ms + (digest % (self.jitter_ms + 1))) / 1000.0
+        text = self._answer(prompt)
+        if not stream:
+            time.sleep(delay)
+            return _StubResponse(text)
+        return self._stream(text, delay)
+
+    def _stream(self, text, delay):
+        words = text.split(" ")
+        step = max(1, len(words) // self.stream_chunks)
+        for i in range(0, len(words), step):
+            time.sleep(delay / self.stream_chunks)
+            yield _StubResponse(" ".join(words[i:i + step]) + " ")
+
+    @staticmethod
+    def _answer(prompt):
+        if "REWRITTEN:" in prompt:
+            question = prompt.split("USER QUESTION:", 1)[-1].split("REWRITTEN:", 1)[0]
+            return question.strip()
+        question = prompt.rsplit("LATEST QUESTION:", 1)[-1].strip()
+        return f"According to the notes, {question} The answer is in the retrieved pages."
+
+
+# ---------------------------------------------------------------- driving the app
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+    return {'count': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+            'mean': round(sum(ordered) / len(ordered), 1), 'max': round(ordered[-1], 1)}
+
+
+def _upload_one(app, path, poll_interval):
+    client = app.test_client()
+    headers = {'X-User-Id': USER_ID}
+    retries = 0
+    start = time.perf_counter()
+    while True:
+        with open(path, "rb") as f:
+            response = client.post('/upload', headers=headers,
+                                   data={'file': (f, os.path.basename(path))})
+        if response.status_code != 503:
+            break
+        retries += 1  # ingestion queue full: back off like a real client would
+        time.sleep(poll_interval * 5)
+    upload_ms = (time.perf_counter() - start) * 1000
+    if response.status_code != 202:
+        return {'file': os.path.basename(path), 'status': 'rejected', 'error': response.get_json()}
+
+    job_id = response.get_json()['job_id']
+    while True:
+        job = client.get(f'/jobs/{job_id}', headers=headers).get_json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(poll_interval)
+    total_ms = (time.perf_counter() - start) * 1000
+
+    record = {
+        'file': os.path.basename(path),
+        'status': job['status'],
+        'retries': retries,
+        'upload_ms': upload_ms,
+        'queue_ms': (job['started_at'] - job['created_at']) * 1000,
+        'processing_ms': (job['finished_at'] - job['started_at']) * 1000,
+        'total_ms': total_ms,
+        'pages': job['pages_total'],
+        'chunks': job['chunks_total'],
+    }
+    record.update((job.get('stats') or {}).get('timings', {}))
+    return record
+
+
+def _ask_one(app, query, history, stream):
+    client = app.test_client()
+    body = {'query': query, 'history': history}
+    headers = {'X-User-Id': USER_ID}
+    start = time.perf_counter()
+    if not stream:
+        response = client.post('/ask', json=body, headers=headers)
+        record = {'status': response.status_code, 'total_ms': (time.perf_counter() - start) * 1000}
+        if response.status_code == 200:
+            result = response.get_json()
+            record['cached'] = bool(result.get('cached'))
+            record.update(result.get('timings') or {})
+        return record
+
+    response = client.post('/ask/stream', json=body, headers=headers, buffered=False)
+    first_token_ms = None
+    for piece in response.response:
+        if first_token_ms is None and b"event: token" in piece:
+            first_token_ms = (time.perf_counter() - start) * 1000
+    response.close()
+    return {'status': response.status_code, 'first_token_ms': first_token_ms,
+            'total_ms': (time.perf_counter() - start) * 1000}
+
+
+def _summarize(records, stages):
+    return {stage: percentiles([r[stage] for r in records if r.get(stage) is not None]) for stage in stages}
+
+
+def run_uploads(app, paths, concurrency, poll_interval):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        records = list(pool.map(lambda p: _upload_one(app, p, poll_interval), paths))
+    elapsed = time.perf_counter() - start
+    done = [r for r in records if r['status'] == 'done']
+    return {
+        'latency_ms': _summarize(done, ['upload_ms', 'queue_ms', 'processing_ms', 'total_ms',
+                                        'extract_ms', 'embed_ms', 'store_ms']),
+        'throughput': {
+            'files_per_s': round(len(done) / elapsed, 3),
+            'pages_per_s': round(sum(r['pages'] for r in done) / elapsed, 2),
+            'chunks_per_s': round(sum(r['chunks'] for r in done) / elapsed, 2),
+        },
+        'wall_s': round(elapsed, 2),
+        'failed': [r for r in records if r['status'] != 'done'],
+        'retries': sum(r.get('retries', 0) for r in records),
+    }
+
+
+def run_queries(app, queries, concurrency, stream):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        records = list(pool.map(lambda q: _ask_one(app, q[0], q[1], stream), queries))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in records if r['status'] == 200]
+    stages = ['total_ms', 'first_token_ms'] if stream else \
+        ['total_ms', 'rewrite_ms', 'retrieval_ms', 'rerank_ms', 'generation_ms']
+    summary = {
+        'latency_ms': _summarize([r for r in ok if not r.get('cached')], stages),
+        'throughput': {'requests_per_s': round(len(ok) / elapsed, 2)},
+        'wall_s': round(elapsed, 2),
+        'errors': len(records) - len(ok),
+    }
+    if not stream:
+        cached = [r for r in ok if r.get('cached')]
+        summary['cached'] = {'count': len(cached), 'latency_ms': percentiles([r['total_ms'] for r in cached])}
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=LLM_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline /upload and /ask benchmark with a stub LLM.")
+    parser.add_argument("--docs", type=int, default=4, help="files of each type (pdf, docx, txt)")
+    parser.add_argument("--pages", type=int, default=6, help="pages per PDF (DOCX/TXT get similar text)")
+    parser.add_argument("--image-ratio", type=float, default=0.25, help="share of PDF pages that are image-only")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--followup-ratio", type=float, default=0.3, help="share of queries with chat history")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--upload-concurrency", type=int, default=None, help="default: --concurrency")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=int, default=100)
+    parser.add_argument("--stream", action="store_true", help="drive /ask/stream and report time to first token")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--workdir", help="scratch directory (default: a temporary one, removed afterwards)")
+    parser.add_argument("--output", help="JSON report path (default: benchmarks/results/rag_<timestamp>.json)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    output = os.path.abspath(args.output or os.path.join(
+        LLM_DIR, "benchmarks", "results", f"rag_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+
+    # The app keeps its stores relative to the working directory
+    os.chdir(workdir)
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-offline")
+    if shutil.which("tesseract") is None:
+        print("⚠️  tesseract not found: image-only pages will yield no text.")
+
+    from app import create_app
+    from app.services import llmServices
+
+    paths, corpus = build_corpus(os.path.join(workdir, "corpus"), args.docs, args.pages,
+                                 args.image_ratio, args.seed)
+    queries = build_queries(args.queries, args.followup_ratio, args.seed)
+
+    app = create_app()
+    llmServices.model = StubModel(args.llm_latency_ms, args.llm_jitter_ms)
+    llmServices.warmup()  # load the embedding model and Chroma before anything is timed
+
+    print(f"Uploading {len(paths)} files...")
+    uploads = run_uploads(app, paths, args.upload_concurrency or args.concurrency, args.poll_interval)
+    llmServices.flush_long_term_memory()
+    print(f"Asking {len(queries)} questions...")
+    asks = run_queries(app, queries, args.concurrency, args.stream)
+    llmServices.flush_long_term_memory()
+
+    report = {
+        'run': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'commit': _git_commit(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('workdir', 'output')},
+            'embedding_backend': app.config.get("EMBEDDING_BACKEND"),
+        },
+        'corpus': corpus,
+        'upload': uploads,
+        'ask': asks,
+        'stats': app.test_client().get('/stats').get_json(),
+    }
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({'upload': uploads['latency_ms'], 'ask': asks['latency_ms']}, indent=2))
+    print(f"Report saved to {output}")
+
+    if not args.workdir:
+        os.chdir(LLM_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,4 +4,101 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class Config:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
\ No newline at end of file
+    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+    # Background ingestion (/upload -> /jobs/<id>)
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+    INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "16"))
+    INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+    INGEST_JOB_DB = os.getenv("INGEST_JOB_DB", "./ingest_jobs.sqlite3")  # job status, shared by all workers
+    UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))  # larger uploads spill to disk
+    # /upload/bulk: several files or ZIP archives in one job
+    BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "200"))
+    BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(512 * 1024 * 1024)))  # after decompression
+    BULK_EXTRACT_WORKERS = int(os.getenv("BULK_EXTRACT_WORKERS", "4"))  # files extracted in parallel
+
+    # PDF OCR stage
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or None  # None = one per core
+    OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "200"))
+    OCR_WINDOW_PAGES = int(os.getenv("OCR_WINDOW_PAGES", "0")) or None  # None = 2 x workers
+    OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "./ocr_cache")
+    OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 0 disables
+
+    # Chunking (tokens of the embedding model; all-MiniLM-L6-v2 truncates at 256)
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+    # Embedding (same model for chunks, queries and chat memory)
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")  # or "onnx" (int8, CPU), "remote"
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+    EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = library default
+    # Shared embedding server (EMBEDDING_BACKEND=remote); gunicorn starts it unless it runs elsewhere
+    EMBEDDING_SERVER_EMBEDDED = os.getenv("EMBEDDING_SERVER_EMBEDDED", "true").lower() == "true"
+    EMBEDDING_SERVER_BACKEND = os.getenv("EMBEDDING_SERVER_BACKEND", "sentence-transformers")
+    EMBEDDING_SERVER_ADDRESS = os.getenv("EMBEDDING_SERVER_ADDRESS", "")  # "" = socket in a private temp dir; or host:port
+    EMBEDDING_SERVER_AUTHKEY = os.getenv("EMBEDDING_SERVER_AUTHKEY")  # no default; gunicorn generates one if unset
+    EMBEDDING_SERVER_TIMEOUT_S = float(os.getenv("EMBEDDING_SERVER_TIMEOUT_S", "30"))
+    EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+    EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))  # chunks per Chroma add
+    BULK_INGEST_BATCH_SIZE = int(os.getenv("BULK_INGEST_BATCH_SIZE", "1024"))  # shared across the files of a bulk job
+    QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048"))
+
+    # /ask stage orchestration
+    STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "16"))
+    REWRITE_TIMEOUT_S = float(os.getenv("REWRITE_TIMEOUT_S", "4"))
+    RETRIEVAL_TIMEOUT_S = float(os.getenv("RETRIEVAL_TIMEOUT_S", "3"))
+    REWRITE_MEMO_SIZE = int(os.getenv("REWRITE_MEMO_SIZE", "1024"))
+
+    # /ask/batch
+    ASK_BATCH_MAX_QUESTIONS = int(os.getenv("ASK_BATCH_MAX_QUESTIONS", "100"))
+    ASK_BATCH_CONCURRENCY = int(os.getenv("ASK_BATCH_CONCURRENCY", "8"))  # Gemini calls in flight, per worker
+
+    # Semantic answer cache for history-free questions
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))  # 0 disables
+    ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+
+    # Retrieval: dense results fused with BM25 by reciprocal rank fusion
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "10"))  # per retriever, before fusion
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "32"))  # users whose collections and BM25 index a worker keeps loaded
+
+    # Optional cross-encoder rerank of the fused candidates
+    RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+    RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0"))  # raw cross-encoder logit
+    RERANK_MAX_CHUNKS = int(os.getenv("RERANK_MAX_CHUNKS", "5"))
+    RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+
+    # Prompt assembly
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+    PROMPT_RECENT_TURNS = int(os.getenv("PROMPT_RECENT_TURNS", "6"))  # chat messages kept verbatim
+
+    # Long-term memory write-behind buffer
+    MEMORY_WRITE_BATCH = int(os.getenv("MEMORY_WRITE_BATCH", "32"))
+    MEMORY_FLUSH_INTERVAL_S = float(os.getenv("MEMORY_FLUSH_INTERVAL_S", "1"))
+
+    # Long-term memory compaction (0 interval disables the background job)
+    MEMORY_COMPACT_INTERVAL_S = int(os.getenv("MEMORY_COMPACT_INTERVAL_S", "600"))
+    MEMORY_TTL_S = int(os.getenv("MEMORY_TTL_S", str(30 * 24 * 3600)))
+    MEMORY_COMPACT_AFTER_S = int(os.getenv("MEMORY_COMPACT_AFTER_S", str(24 * 3600)))  # turns older than this get summarized
+    MEMORY_COMPACT_MIN_TURNS = int(os.getenv("MEMORY_COMPACT_MIN_TURNS", "10"))
+    MEMORY_TURNS_PER_SUMMARY = int(os.getenv("MEMORY_TURNS_PER_SUMMARY", "20"))
+    MEMORY_MAX_PER_SESSION = int(os.getenv("MEMORY_MAX_PER_SESSION", "200"))
+
+    # Start loading models in the background at startup instead of on first use / first /ready probe
+    WARMUP_ON_START = os.getenv("WARMUP_ON_START", "false").lower() == "true"
+
+    # Observability: stage histograms on /metrics and trace ids in log lines
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    SLOW_SPAN_LOG_MS = float(os.getenv("SLOW_SPAN_LOG_MS", "0"))  # log spans slower than this; 0 = off
+    TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Request-Id")
+    # Directory where each worker writes its metrics for /metrics to sum; gunicorn sets one up if empty
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+    METRICS_FLUSH_INTERVAL_S = float(os.getenv("METRICS_FLUSH_INTERVAL_S", "1"))
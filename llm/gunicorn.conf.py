@@ -0,0 +1,37 @@
+# gunicorn.conf.py
+# Picked up automatically by `gunicorn wsgi:app` from this directory.
+# With EMBEDDING_BACKEND=remote the master starts one embedding server
+# before forking workers, so the host holds a single copy of the model.
+import glob
+import os
+import secrets
+import tempfile
+
+from config import Config
+
+if Config.EMBEDDING_BACKEND == "remote" and Config.EMBEDDING_SERVER_EMBEDDED and not Config.EMBEDDING_SERVER_AUTHKEY:
+    # A fresh secret per start. Set here, before the app is loaded or workers
+    # fork, so the server and every worker (re-exec'd ones too) see the same key
+    os.environ["EMBEDDING_SERVER_AUTHKEY"] = Config.EMBEDDING_SERVER_AUTHKEY = secrets.token_hex(32)
+
+if not Config.METRICS_MULTIPROC_DIR:
+    # Workers share the listen socket, so /metrics must sum all of them
+    os.environ["METRICS_MULTIPROC_DIR"] = Config.METRICS_MULTIPROC_DIR = tempfile.mkdtemp(prefix="study_buddy_metrics_")
+
+
+def on_starting(server):
+    # Counts left by a previous run would be summed into this one's
+    for path in glob.glob(os.path.join(Config.METRICS_MULTIPROC_DIR, "*.json")):
+        os.remove(path)
+    if Config.EMBEDDING_BACKEND == "remote" and Config.EMBEDDING_SERVER_EMBEDDED:
+        from app.services.embeddingServer import ServerSupervisor
+        settings = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+        # Restarted from here if it dies; workers fail fast until it is back
+        server.embedding_server = ServerSupervisor(settings, server.log.warning).start()
+        server.log.info("Started embedding server (pid %s)", server.embedding_server.process.pid)
+
+
+def on_exit(server):
+    supervisor = getattr(server, 'embedding_server', None)
+    if supervisor is not None:
+        supervisor.stop()
@@ -0,0 +1,76 @@
+# conftest.py
+# Shared fixtures: llmServices configured against a temp directory, with a
+# hashing stub in place of the embedding model and a canned Gemini, so the
+# tests need neither model weights nor an API key.
+import hashlib
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from app.services import llmServices  # noqa: E402
+
+
+class StubTokenizer:
+    def tokenize(self, text):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+
+class StubEmbeddingModel:
+    """Bag-of-words vectors: the same words give the same unit vector."""
+
+    tokenizer = StubTokenizer()
+    max_seq_length = 256
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+            vectors[row] /= np.linalg.norm(vectors[row]) or 1
+        return vectors
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGenerativeModel:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.prompts.append(prompt)
+        if stream:
+            return iter([StubResponse("stub "), StubResponse("answer")])
+        return StubResponse("stub answer")
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    """llmServices initialised by init_rag() in ``tmp_path``; returns the module."""
+    monkeypatch.chdir(tmp_path)
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(
+        GOOGLE_API_KEY="test",
+        HYBRID_SEARCH=False,
+        RERANK_ENABLED=False,
+        WARMUP_ON_START=False,
+        OCR_CACHE_MAX_BYTES=0,
+        RETRIEVAL_TIMEOUT_S=0.2,
+    )
+    llmServices.init_rag(app)
+    monkeypatch.setattr(llmServices, 'embedding_model', StubEmbeddingModel())
+    monkeypatch.setattr(llmServices, 'model', StubGenerativeModel())
+    yield llmServices
+    llmServices._stage_pool.shutdown(wait=False, cancel_futures=True)
+    llmServices._batch_pool.shutdown(wait=False, cancel_futures=True)
+    llmServices._memory_buffer.close()
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+CHUNK = ("Entropy is a measure of disorder.", {'page': 1, 'page_end': 1, 'source': 'notes.txt', 'doc_id': 'notes.txt'})
+
+
+@pytest.fixture
+def retrieval(rag, monkeypatch):
+    """Controls retrieve_documents: ``state['mode']`` is 'ok', 'slow' or 'error'."""
+    state = {'mode': 'ok'}
+    released = threading.Event()
+
+    def retrieve_documents(query_text, user_id, doc_id=None, query_embedding=None, timings=None):
+        if state['mode'] == 'slow':
+            released.wait(5)
+        elif state['mode'] == 'error':
+            raise RuntimeError("chroma unavailable")
+        return [CHUNK]
+
+    monkeypatch.setattr(rag, 'retrieve_documents', retrieve_documents)
+    monkeypatch.setattr(rag, '_retrieve_memory', lambda *args, **kwargs: [])
+    yield state
+    released.set()
+
+
+@pytest.mark.parametrize('mode', ['slow', 'error'])
+def test_answer_from_degraded_retrieval_is_not_cached(rag, retrieval, mode):
+    retrieval['mode'] = mode
+    degraded = rag.get_conversational_answer("What is entropy?", [])
+    assert degraded['sources'] == []
+
+    retrieval['mode'] = 'ok'
+    result = rag.get_conversational_answer("What is entropy?", [])
+    assert 'cached' not in result
+    assert result['sources'] == [CHUNK[1]]
+    assert rag.get_conversational_answer("What is entropy?", [])['cached'] is True
+
+
+def test_streamed_answer_from_degraded_retrieval_is_not_cached(rag, retrieval):
+    retrieval['mode'] = 'error'
+    events = list(rag.stream_conversational_answer("What is entropy?", []))
+    assert events[0] == ('sources', [])
+
+    retrieval['mode'] = 'ok'
+    events = list(rag.stream_conversational_answer("What is entropy?", []))
+    assert events[0] == ('sources', [CHUNK[1]])
+    assert events[-1][0] == 'prompt_tokens'
+
+
+class FlakyCollection:
+    """Chroma collection stub whose query() fails while ``failing`` is set."""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.failing = False
+
+    def query(self, query_embeddings, n_results, where=None):
+        if self.failing:
+            raise RuntimeError("chroma unavailable")
+        ids, documents, metadatas = [], [], []
+        for _ in query_embeddings:
+            ids.append([f"c{i}" for i in range(len(self.hits))])
+            documents.append([doc for doc, _ in self.hits])
+            metadatas.append([meta for _, meta in self.hits])
+        return {'ids': ids, 'documents': documents, 'metadatas': metadatas}
+
+
+def test_batch_answer_from_failed_retrieval_is_not_cached(rag, monkeypatch):
+    doc_collection, chat_collection = FlakyCollection([CHUNK]), FlakyCollection([])
+    monkeypatch.setattr(rag, 'get_collections', lambda user_id: (doc_collection, chat_collection))
+    questions = [{'query': "What is entropy?", 'history': [], 'doc_id': None}]
+
+    doc_collection.failing = True
+    results, _ = rag.answer_batch(questions)
+    assert results[0]['sources'] == [] and results[0]['cached'] is False
+
+    doc_collection.failing = False
+    results, _ = rag.answer_batch(questions)
+    assert results[0]['sources'] == [CHUNK[1]] and results[0]['cached'] is False
+    results, _ = rag.answer_batch(questions)
+    assert results[0]['cached'] is True
+
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+
+
+class StubCollection:
+    """In-memory stand-in for a Chroma collection; ``where`` filters match metadata exactly."""
+
+    def __init__(self):
+        self.rows = {}  # id -> (document, metadata)
+
+    def _matching(self, ids=None, where=None):
+        return [chunk_id for chunk_id, (_, meta) in self.rows.items()
+                if (ids is None or chunk_id in ids) and all(meta.get(k) == v for k, v in (where or {}).items())]
+
+    def get(self, ids=None, where=None, include=(), limit=None, offset=0):
+        found = self._matching(ids, where)[offset:None if limit is None else offset + limit]
+        return {'ids': found,
+                'documents': [self.rows[chunk_id][0] for chunk_id in found],
+                'metadatas': [self.rows[chunk_id][1] for chunk_id in found]}
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        for chunk_id, document, meta in zip(ids, documents, metadatas):
+            self.rows[chunk_id] = (document, meta)
+
+    def update(self, ids, metadatas):
+        for chunk_id, meta in zip(ids, metadatas):
+            self.rows[chunk_id] = (self.rows[chunk_id][0], meta)
+
+    def delete(self, ids=None, where=None):
+        for chunk_id in self._matching(ids, where):
+            del self.rows[chunk_id]
+
+    def documents(self):
+        return sorted(document for document, _ in self.rows.values())
+
+
+class ExtractionError(RuntimeError):
+    pass
+
+
+@pytest.fixture
+def store(rag, monkeypatch):
+    """Stub collections for the default user; extract_text yields the chunks ``upload()`` is given."""
+    docs, chat = StubCollection(), StubCollection()
+    monkeypatch.setattr(rag, 'get_collections', lambda user_id: (docs, chat))
+    monkeypatch.setattr(rag, '_ingest_batch_size', 1)  # store each chunk before extracting the next
+
+    def upload(*contents, fail=False):
+        def extract_text(source, filename, on_page=None):
+            for page, content in enumerate(contents, 1):
+                yield {'content': content, 'page_number': page, 'page_end': page}
+            if fail:
+                raise ExtractionError("Could not read PDF notes.pdf: truncated file")
+        monkeypatch.setattr(rag, 'extract_text', extract_text)
+        return rag.ingest_document(io.BytesIO(b""), "notes.pdf", rag.DEFAULT_USER_ID, "notes.pdf")
+
+    def remember():
+        chat.add(ids=["chat_1"], documents=["User: what is entropy?\nAssistant: disorder."],
+                 metadatas=[{'doc_id': "notes.pdf", 'kind': 'turn'}])
+
+    return docs, chat, upload, remember
+
+
+def test_unchanged_reupload_keeps_chunks_and_chat(store):
+    docs, chat, upload, remember = store
+    upload("Entropy is disorder.", "Energy is conserved.", "CS101 covers heat.")
+    remember()
+
+    stats = upload("Entropy is disorder.", "Energy is conserved.", "CS101 covers heat.")
+
+    assert (stats['chunks_added'], stats['chunks_reused'], stats['chunks_deleted']) == (0, 3, 0)
+    assert docs.documents() == ["CS101 covers heat.", "Energy is conserved.", "Entropy is disorder."]
+    assert list(chat.rows) == ["chat_1"]
+
+
+def test_one_chunk_edit_replaces_that_chunk_and_clears_chat(store):
+    docs, chat, upload, remember = store
+    upload("Entropy is disorder.", "Energy is conserved.", "CS101 covers heat.")
+    remember()
+
+    stats = upload("Entropy is disorder.", "Energy is conserved.", "CS102 covers heat.")
+
+    assert (stats['chunks_added'], stats['chunks_reused'], stats['chunks_deleted']) == (1, 2, 1)
+    assert docs.documents() == ["CS102 covers heat.", "Energy is conserved.", "Entropy is disorder."]
+    assert chat.rows == {}
+
+
+def test_failure_partway_keeps_previous_version(store):
+    docs, chat, upload, remember = store
+    upload("Entropy is disorder.", "Energy is conserved.", "CS101 covers heat.")
+    remember()
+    before = dict(docs.rows)
+
+    with pytest.raises(ExtractionError):
+        upload("Entropy is disorder.", "A new paragraph on enthalpy.", fail=True)
+
+    assert docs.rows == before
+    assert list(chat.rows) == ["chat_1"]